@@ -0,0 +1,85 @@
+"""Compare PayeeMatcher against the old linear scan over PayeeRules.
+
+Usage: python benchmarks/bench_matcher.py [--rules 5000] [--payees 2000]
+"""
+
+import argparse
+import random
+import re
+import string
+import time
+
+from bank.matcher import PayeeMatcher
+
+
+def fake_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_uppercase, k=rng.randint(4, 12)))
+
+
+def fake_rules(rng: random.Random, count: int) -> list[str]:
+    """Roughly what an account learns over time: mostly literal prefixes"""
+    patterns = []
+    for _ in range(count):
+        word = fake_word(rng)
+        kind = rng.random()
+        if kind < 0.7:
+            patterns.append(f"^{word}")
+        elif kind < 0.85:
+            patterns.append(f"^{word} {fake_word(rng)}")
+        elif kind < 0.95:
+            patterns.append(word)
+        else:
+            patterns.append(f"{word}.*(GMBH|AG)")
+    return patterns
+
+
+def fake_payees(rng: random.Random, patterns: list[str], count: int) -> list[str]:
+    """Half of the payees are known, half are new"""
+    payees = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            head = re.sub(r"[\^.*()|]|GMBH|AG", "", rng.choice(patterns))
+        else:
+            head = fake_word(rng)
+        payees.append(f"{head} SAGT DANKE. {rng.randint(10**7, 10**8)}//Berlin/DE")
+    return payees
+
+
+def timed(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:<24}{time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=5000)
+    parser.add_argument("--payees", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1369)
+    patterns = fake_rules(rng, args.rules)
+    payees = fake_payees(rng, patterns, args.payees)
+    print(f"{args.rules} rules, {args.payees} payees")
+
+    regexes = timed(
+        "compile one by one",
+        lambda: [re.compile(p, re.IGNORECASE) for p in patterns],
+    )
+
+    def linear_scan(payee):
+        for index, regex in enumerate(regexes):
+            if regex.search(payee):
+                return index
+        return None
+
+    expected = timed("linear scan", lambda: [linear_scan(p) for p in payees])
+    matcher = timed("build matcher", lambda: PayeeMatcher(patterns))
+    found = timed("matcher", lambda: [matcher.first_match(p) for p in payees])
+    timed("add 100 rules", lambda: [matcher.add(p) for p in fake_rules(rng, 100)])
+    assert found == expected, "matcher and linear scan disagree"
+
+
+if __name__ == "__main__":
+    main()
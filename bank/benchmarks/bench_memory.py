@@ -0,0 +1,101 @@
+"""Peak memory of a run reading a CSV at once versus in chunks.
+
+Generates a synthetic Berliner Sparkasse export, then runs bank.main on
+it in a fresh process for each mode and reports the peak RSS.
+
+Usage: python benchmarks/bench_memory.py [--rows 1000000] [--chunksize 50000]
+"""
+
+import argparse
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HEADER = (
+    '"Auftragskonto";"Buchungstag";"Valutadatum";"Buchungstext";'
+    '"Verwendungszweck";"Glaeubiger ID";"Mandatsreferenz";'
+    '"Kundenreferenz (End-to-End)";"Sammlerreferenz";'
+    '"Lastschrift Ursprungsbetrag";"Auslagenersatz Ruecklastschrift";'
+    '"Beguenstigter/Zahlungspflichtiger";"Kontonummer/IBAN";"BIC (SWIFT-Code)";'
+    '"Betrag";"Waehrung";"Info"\n'
+)
+PAYEES = [f"PAYEE {index} SAGT DANKE//Berlin/DE" for index in range(500)]
+
+
+def write_statement(path: Path, rows: int):
+    rng = random.Random(1369)
+    with open(path, "w", encoding="ISO-8859-1") as file:
+        file.write(HEADER)
+        for index in range(rows):
+            day = 1 + (rows - index) * 27 // rows
+            amount = f"-{rng.randint(1, 99999) / 100:.2f}".replace(".", ",")
+            file.write(
+                f'"DE98100500006016829526";"{day:02}.03.23";"{day:02}.03.23";'
+                f'"KARTENZAHLUNG";"2023-03-{day:02}T13:00 Debitk.0 2024-12 ";"";"";'
+                f'"{index:026}";"";"";"";"{rng.choice(PAYEES)}";'
+                f'"DE29300600100005021573";"GENODEDDXXX";'
+                f'"{amount}";"EUR";"Umsatz gebucht"\n'
+            )
+
+
+def run(src: Path, chunksize: int):
+    """Run in this process, print the peak RSS in MB and the duration"""
+    from bank.main import app
+
+    start = time.perf_counter()
+    try:
+        app(
+            [
+                "bench",
+                "--src",
+                src.as_posix(),
+                "--target",
+                (src.parent / "upload_me.csv").as_posix(),
+                "--batch",
+                "--no-dedup",
+                "--chunksize",
+                str(chunksize),
+            ],
+            standalone_mode=False,
+        )
+    finally:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        peak_mb = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+        sys.stderr.write(f"{peak_mb:.0f} {time.perf_counter() - start:.1f}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunksize", type=int, default=50_000)
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(Path(args.run), args.chunksize)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / "umsatz.CSV"
+        write_statement(src, args.rows)
+        (Path(tmp) / "payees_rules").mkdir()
+        print(f"{args.rows} rows, {src.stat().st_size / 1024 / 1024:.0f} MB")
+        for label, chunksize in [("at once", 0), ("chunked", args.chunksize)]:
+            result = subprocess.run(
+                [sys.executable, __file__, "--run", src, "--chunksize", str(chunksize)],
+                cwd=tmp,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            peak_mb, seconds = result.stderr.split()[-2:]
+            print(f"{label:<10}{peak_mb:>6} MB peak RSS {seconds:>6}s")
+
+
+if __name__ == "__main__":
+    main()
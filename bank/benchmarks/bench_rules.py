@@ -0,0 +1,39 @@
+"""Construction time and memory of 10k rules, PayeeRule versus Rule.
+
+Usage: python benchmarks/bench_rules.py [--rules 10000]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from bank.payees import PayeeRule, Rule
+
+
+def measure(label: str, build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rules = build()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<12}{elapsed * 1000:8.1f} ms {peak / 1024 / 1024:8.2f} MB")
+    return rules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=10_000)
+    args = parser.parse_args()
+
+    rows = [(f"^PAYEE {index}", f"Payee {index}") for index in range(args.rules)]
+    print(f"{args.rules} rules")
+    measure(
+        "PayeeRule",
+        lambda: [PayeeRule(pattern=pattern, replacement=r) for pattern, r in rows],
+    )
+    measure("Rule", lambda: [Rule(*row) for row in rows])
+
+
+if __name__ == "__main__":
+    main()
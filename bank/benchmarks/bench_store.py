@@ -0,0 +1,57 @@
+"""Load and save times of the payees rules, YAML versus the SQLite store.
+
+Usage: python benchmarks/bench_store.py [--rules 10000]
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from bank.payees import PayeeRule, Payees, Rule
+
+
+def timed(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:<32}{(time.perf_counter() - start) * 1000:8.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=10_000)
+    args = parser.parse_args()
+
+    raw_rules = [
+        {"pattern": f"^PAYEE {index}", "replacement": f"Payee {index}"}
+        for index in range(args.rules)
+    ]
+    print(f"{args.rules} rules")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        Payees.prefix = Path(tmp)
+        data_file = Path(tmp) / "payees_bench.yaml"
+        data_file.write_text(yaml.safe_dump(raw_rules))
+
+        def yaml_load():
+            return [PayeeRule(**pr) for pr in yaml.safe_load(open(data_file, "r"))]
+
+        rules = timed("YAML load", yaml_load)
+        timed(
+            "YAML save",
+            lambda: data_file.write_text(yaml.safe_dump([r.dict() for r in rules])),
+        )
+
+        timed("store: migrate from YAML", lambda: Payees(account="bench"))
+        payees = timed("store: load", lambda: Payees(account="bench"))
+        payees.payees_rules.append(Rule("^NEW", "New"))
+        timed("store: save one new rule", payees.save)
+        payees.remember("NEW PAYEE", "New")
+        timed("store: save one cache entry", payees.save)
+
+
+if __name__ == "__main__":
+    main()
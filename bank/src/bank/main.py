@@ -4,112 +4,378 @@ It keeps a local map of payees per user so that you can reuse them. They
 are very specific file formats, so this is probably of no use to anyone
 else.
 
-Usage: python src/bank/main.py [USER] /path/to/a/file.CSV
+Usage: python src/bank/main.py [USER] --src /path/to/csvs --target upload_me.csv
 """
 
+import os
+import sys
 import pandas as pd
-import re
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from typing import Any, Iterable, Iterator, Optional
 
 from typing_extensions import Annotated
 from pathlib import Path
-from typer import Argument, Typer
-from datetime import datetime
+from typer import Argument, Option, Typer
 
 from bank.payees import Payees
+from bank.transactions import TransactionIndex, booking_keys
 
 app = Typer()
 
+# My bank generates CSVs in different formats for differet types of
+# accounts
+FIELD_NAMES = {
+    "BERLINER": {
+        "Date": "Buchungstag",
+        "Payee": "Beguenstigter/Zahlungspflichtiger",
+        "Memo": "Verwendungszweck",
+        "Amount": "Betrag",
+        "Info": "Info",
+        "Account": "Auftragskonto",
+        "Reference": "Kundenreferenz (End-to-End)",
+    },
+    "CREDIT": {
+        "Date": "Buchungsdatum",
+        "Payee": "Transaktionsbeschreibung",
+        "Memo": "Gebührenschlüssel",
+        "Amount": "Buchungsbetrag",
+        "Info": "Länderkennzeichen",
+        "Account": "Umsatz getätigt von",
+        "Reference": "Buchungsreferenz",
+    },
+}
+EXPORT_COLUMNS = ["Date", "Payee", "Memo", "Amount", "Info", "Key"]
+CSV_OPTIONS: dict[str, Any] = {"sep": ";", "encoding": "ISO-8859-1", "dtype": str}
+
+
+def find_sources(src: str) -> list[Path]:
+    """All the CSV files in src, which can be a file, a directory or a glob."""
+    src_path = Path(src)
+    if src_path.is_file():
+        return [src_path]
+    if src_path.is_dir():
+        candidates = src_path.iterdir()
+    else:
+        candidates = (Path(match) for match in glob(src, recursive=True))
+    return sorted(
+        path for path in candidates if path.is_file() and path.suffix.lower() == ".csv"
+    )
+
+
+def detect_fields_map(src_path: Path) -> dict[str, str]:
+    """Pick the field names matching the header of a CSV file.
+
+    Raises:
+        ValueError: if the header doesn't match any known format
+    """
+    header = pd.read_csv(src_path, nrows=0, **CSV_OPTIONS).columns
+    for fields_map in FIELD_NAMES.values():
+        if set(fields_map.values()).issubset(header):
+            return fields_map
+    raise ValueError(f"Unknown CSV format: {src_path}")
+
+
+def read_statement(src_path: Path) -> pd.DataFrame:
+    """Read and transform a single CSV. Runs in a worker process."""
+    fields_map = detect_fields_map(src_path)
+    return transform(pd.read_csv(src_path, **CSV_OPTIONS), fields_map)
+
+
+def read_statements(sources: list[Path], done: list[Path]) -> list[pd.DataFrame]:
+    """Read all the CSVs, in parallel when there is more than one.
+
+    Files that can't be read are reported and skipped; the ones read are
+    added to done.
+    """
+    if len(sources) == 1:
+        results = {sources[0]: _try(read_statement, sources[0])}
+    else:
+        workers = min(len(sources), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {path: executor.submit(read_statement, path) for path in sources}
+            results = {path: _try(future.result) for path, future in futures.items()}
+
+    frames = []
+    for src_path, result in results.items():
+        if isinstance(result, BaseException):
+            print(f"Could not read {src_path}", result)
+        else:
+            frames.append(result)
+            done.append(src_path)
+    return frames
+
+
+def stream_statements(
+    sources: list[Path], chunksize: int, done: list[Path]
+) -> Iterator[pd.DataFrame]:
+    """Read and transform the CSVs one after the other, a chunk at a time.
+
+    Files that can't be read are reported and skipped; the ones read in
+    full are added to done.
+    """
+    for src_path in sources:
+        try:
+            fields_map = detect_fields_map(src_path)
+            counts: dict[str, int] = {}
+            with pd.read_csv(src_path, chunksize=chunksize, **CSV_OPTIONS) as reader:
+                for df in reader:
+                    yield transform(df, fields_map, counts)
+            done.append(src_path)
+        except Exception as exc:
+            print(f"Could not read {src_path}", exc)
+
+
+def _try(func, *args):
+    try:
+        return func(*args)
+    except Exception as exc:
+        return exc
+
+
+def transform(
+    df: pd.DataFrame,
+    fields_map: dict[str, str],
+    counts: Optional[dict[str, int]] = None,
+) -> pd.DataFrame:
+    """Map a bank CSV to the YNAB columns, one whole column at a time.
+
+    Args:
+        df (pd.DataFrame): the CSV as read, with all columns as strings
+        fields_map (dict[str, str]): YNAB column => bank column
+        counts (Optional[dict[str, int]]): when reading a CSV in chunks,
+            what booking_keys saw in the previous chunks
+
+    Returns:
+        pd.DataFrame: Date, Payee, Memo, Amount and Info columns, plus
+        the Key identifying each booking, without bookings that are only
+        scheduled
+    """
+    transformed_df = pd.DataFrame().assign(
+        Date=pd.to_datetime(df[fields_map["Date"]], format="%d.%m.%y").dt.strftime(
+            "%m/%d/%y"
+        ),
+        Payee=df[fields_map["Payee"]]
+        .fillna("")
+        .str.replace(r" {2,}", " ", regex=True)
+        .str.strip(),
+        Memo=df[fields_map["Memo"]],
+        Amount=pd.to_numeric(
+            df[fields_map["Amount"]].str.replace(",", ".", regex=False)
+        ),
+        Info=df[fields_map["Info"]],
+    )
+
+    # remove future payments, which mess up everything
+    transformed_df = transformed_df[transformed_df["Info"] != "Umsatz vorgemerkt"]
+    return transformed_df.assign(
+        Key=booking_keys(df.loc[transformed_df.index], fields_map, counts)
+    )
+
+
+def resolve_payees(
+    df: pd.DataFrame,
+    payees_rules: Payees,
+    batch: bool = False,
+    known: Optional[dict[str, str]] = None,
+) -> pd.Series:
+    """Ask for each distinct payee once, then map the answers to all rows.
+
+    Args:
+        df (pd.DataFrame): transformed bookings
+        payees_rules (Payees): the rules for the account
+        batch (bool): don't ask, use only what is already known. Payees
+            that can't be resolved are left as they are
+        known (Optional[dict[str, str]]): payees resolved earlier in the
+            same run, which are not asked about again. Updated in place
+
+    Returns:
+        pd.Series: the replaced payees, aligned with df
+    """
+    known = {} if known is None else known
+    if batch:
+        for payee in df["Payee"].unique():
+            if payee not in known:
+                known[payee] = payees_rules.lookup(payee) or payee
+        return df["Payee"].map(known)
+
+    counts = df["Payee"].value_counts(sort=False)
+    for payee, amount, memo in df.drop_duplicates("Payee")[
+        ["Payee", "Amount", "Memo"]
+    ].itertuples(index=False):
+        if payee in known:
+            continue
+        print("-----------------------")
+        print(payee, f"/ {amount:.2f} / {memo} / {counts[payee]} booking(s)")
+        known[payee] = payees_rules.replace_payee(payee)
+    return df["Payee"].map(known)
+
+
+def export(generated_df: pd.DataFrame, target: str, append: bool = False):
+    """Write bookings in the YNAB format, or add them to the end of target."""
+    generated_df.drop(columns="Key").to_csv(
+        target,
+        sep=",",
+        encoding="utf-8",
+        index=False,
+        float_format="%.2f",
+        mode="a" if append else "w",
+        header=not append,
+    )
+
+
+def replace_in_export(target: str, replacements: dict[str, str], chunksize: int):
+    """Replace payees in an already generated file, a chunk at a time.
+
+    Everything is read and written back as text, so that nothing but the
+    payees changes.
+    """
+    tmp_target = f"{target}.tmp"
+    with pd.read_csv(
+        target, chunksize=chunksize, dtype=str, keep_default_na=False
+    ) as reader:
+        for index, generated_df in enumerate(reader):
+            generated_df["Payee"] = generated_df["Payee"].replace(replacements)
+            generated_df.to_csv(
+                tmp_target,
+                index=False,
+                mode="a" if index else "w",
+                header=not index,
+            )
+    os.replace(tmp_target, target)
+
 
 @app.command()
 def main(
-    account: Annotated[Optional[str], Argument(help="she or he or any other shortcut")],
-    src: Annotated[str, Argument(help="The path to a CSV file")],
+    account: Annotated[
+        str, Argument(help="she or he or any other shortcut")
+    ] = "default",
+    src: Annotated[
+        str, Option(help="A CSV file, a directory of CSV files or a glob")
+    ] = ".",
     target: Annotated[
-        Optional[str], Argument(help="The path to the generated CSV file")
+        str, Option(help="The path to the generated CSV file")
     ] = "./upload_me.csv",
+    batch: Annotated[
+        bool,
+        Option(help="Don't ask, only use payees already known. Others go to review"),
+    ] = False,
+    review: Annotated[
+        bool, Option(help="With --batch, go through the payees to review at the end")
+    ] = False,
+    dedup: Annotated[
+        bool, Option(help="Skip bookings that were already exported before")
+    ] = True,
+    export_rules: Annotated[
+        bool, Option(help="Write the payees rules to YAML, to edit them by hand")
+    ] = False,
+    chunksize: Annotated[
+        int,
+        Option(help="Stream the CSVs this many rows at a time, to save memory"),
+    ] = 0,
 ):
     """Converts one or more csv to a YNAB fiendly version.
 
+    All the CSVs are parsed in parallel and end up in a single file, so
+    that each payee is only resolved once. With --chunksize they are read
+    one after the other instead, and each chunk is written to the target
+    as soon as it is done, so that memory use doesn't grow with the size
+    of the CSVs.
+
     Args:
-        src (str, optional): _description_. Defaults to Argument( ...,
-        help="The path to a CSV file"
-        ).
-        target (Optional[str], optional): _description_. Defaults to
-        Option( "./upload_me.csv", help="The path to the generated CSV
-        file" ).
+        account (str): whose payees rules to use
+        src (str): a CSV file, a directory with CSV files, or a glob
+        target (str): the path to the generated CSV file
+        batch (bool): resolve payees without asking; the ones not known
+        yet are written to a review file. Always on when not running in
+        a terminal
+        review (bool): at the end of a batch run, ask about all the
+        payees waiting for review in one go
+        dedup (bool): leave out bookings already exported by a previous
+        run, or present in more than one of the CSVs
+        export_rules (bool): at the end, write the payees rules to their
+        YAML file. Changes to that file are picked up on the next run
+        chunksize (int): how many rows to read at a time; 0 reads each
+        CSV at once
     """
-    payees_rules = Payees(account=account)
-    generated_df = pd.DataFrame()
-
-    # My bank generates CSVs in different formats for differet types of
-    # accounts
-    field_names = {
-        "BERLINER": {
-            "Date": "Buchungstag",
-            "Payee": "Beguenstigter/Zahlungspflichtiger",
-            "Memo": "Verwendungszweck",
-            "Amount": "Betrag",
-            "Info": "Info",
-        },
-        "CREDIT": {
-            "Date": "Buchungsdatum",
-            "Payee": "Transaktionsbeschreibung",
-            "Memo": "Gebührenschlüssel",
-            "Amount": "Buchungsbetrag",
-            "Info": "Länderkennzeichen",
-        },
-    }
-
-    src_path = Path(src)
-    if not src_path.is_file():
-        print(f"This scripts needs a CSV file, is this a directory? {src}")
+    sources = find_sources(src)
+    if not sources:
+        print(f"No CSV files found in {src}")
         exit(1)
 
-    # One way to recognize the account type is that the CSV for credit
-    # card accounts are in the format
-    # umsatz-4208________2905-20240319.CSV
-    if "_______" in src_path.as_posix():
-        fields_map = field_names["CREDIT"]
-    else:
-        fields_map = field_names["BERLINER"]
+    if not batch and not sys.stdin.isatty():
+        print("Not running in a terminal, switching to --batch")
+        batch = True
 
-    try:
-        df = pd.read_csv(src_path, sep=";", encoding="ISO-8859-1")
-
-        transformed_df = pd.DataFrame().assign(
-            Date=df[fields_map["Date"]].map(
-                lambda datum: datetime.strftime(
-                    datetime.strptime(datum, "%d.%m.%y"),
-                    "%m/%d/%y",
-                )
-            ),
-            Payee=df[fields_map["Payee"]].fillna(""),
-            Memo=df[fields_map["Memo"]],
-            Amount=df[fields_map["Amount"]].map(
-                lambda amount: amount.replace(",", ".")
-            ),
-            Info=df[fields_map["Info"]],
+    payees_rules = Payees(account=account)
+    transactions = None
+    if dedup:
+        transactions = TransactionIndex(
+            Payees.prefix / f"transactions_{account.lower()}.idx"
         )
 
-        # remove future payments, which mess up everything
-        transformed_df = transformed_df[transformed_df["Info"] != "Umsatz vorgemerkt"]
+    done: list[Path] = []
+    frames: Iterable[pd.DataFrame]
+    if chunksize:
+        frames = stream_statements(sources, chunksize, done)
+    else:
+        statements = read_statements(sources, done)
+        frames = (
+            [pd.concat(statements, axis=0, ignore_index=True)] if statements else []
+        )
 
-        generated_df = pd.concat([generated_df, transformed_df], axis=0)
-    except BaseException as exc:
-        print(f"Could not read {src_path}", exc)
+    known: dict[str, str] = {}
+    skipped = 0
+    append = False
+    # without --chunksize, the bookings are only written after the review
+    held_df = None
+    for generated_df in frames:
+        if transactions is not None:
+            before = len(generated_df)
+            generated_df = generated_df.drop_duplicates("Key")
+            generated_df = generated_df[transactions.unseen(generated_df["Key"])]
+            skipped += before - len(generated_df)
 
-    for index, row in generated_df.iterrows():
-        cleanedup_payee = re.sub(r" {2,}", " ", row["Payee"]).strip()
-        also_show = f"/ {row['Amount']} / {row['Memo']}"
-        print("-----------------------")
-        print(cleanedup_payee, also_show)
-        row["Payee"] = payees_rules.replace_payee(cleanedup_payee)
-        generated_df.loc[index] = row
+        if not generated_df.empty:
+            generated_df["Payee"] = resolve_payees(
+                generated_df, payees_rules, batch, known
+            )
+
+        if not chunksize:
+            held_df = generated_df
+            continue
+        export(generated_df, target, append)
+        append = True
+        if transactions is not None:
+            transactions.add(generated_df["Key"])
+
+    if transactions is not None:
+        print(f"Skipped {skipped} booking(s) already exported")
+
+    reviewed: dict[str, str] = {}
+    if batch and review:
+        reviewed = payees_rules.review()
+    elif payees_rules.unresolved:
+        print(
+            f"{len(payees_rules.unresolved)} payee(s) to review in "
+            f"{payees_rules.review_file}"
+        )
+
+    if held_df is not None:
+        held_df["Payee"] = held_df["Payee"].replace(reviewed)
+        export(held_df, target)
+        if transactions is not None:
+            transactions.add(held_df["Key"])
+    elif not append:
+        export(pd.DataFrame(columns=EXPORT_COLUMNS), target)
+    elif reviewed:
+        replace_in_export(target, reviewed, chunksize)
 
-    generated_df.to_csv(target, sep=",", encoding="utf-8", index=False)
     payees_rules.save()
-    print(f"Generated {target}")
+    if export_rules:
+        payees_rules.export_yaml()
+        print(f"Exported rules to {payees_rules.data_file}")
+    print(f"{len(done)} file(s) generated into {target}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+"""Find the first payee rule that matches a payee without scanning them all.
+
+Most rules are learned interactively and end up as plain literals,
+typically anchored at the start (`^REWE`). Those go into hash indexes
+keyed on the lowercased literal, so matching them costs a few dict
+lookups per payee regardless of how many rules there are. Every other
+pattern is a real regex: those are grouped into chunks, and each chunk
+is folded into a single alternation which acts as a prefilter, so only
+chunks that can match are scanned rule by rule.
+
+The result is always the lowest matching rule index, i.e. the same
+first-match-wins semantics as a linear scan over the rules.
+"""
+
+import re
+from typing import Iterable, Optional
+
+FLAGS = re.IGNORECASE
+
+# Under re.IGNORECASE these match ASCII letters although str.lower()
+# says otherwise, so payees containing them skip the literal indexes
+FOLD_EXCEPTIONS = frozenset("\u0130\u0131\u017f")
+
+# Backreferences, named groups and conditionals cannot be renumbered
+# inside an alternation, so patterns using them get a chunk of their own
+UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?\(")
+
+# Adding a rule recompiles only the last chunk, so this caps the cost
+# of learning a new rule mid-session
+CHUNK_SIZE = 200
+
+SPECIAL = frozenset(".^$*+?{}[]|()\\")
+
+
+def as_literal(pattern: str) -> Optional[str]:
+    """Return the ASCII string a pattern matches verbatim, if it is one."""
+    chars = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            if char.isalnum():
+                return None
+            chars.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in SPECIAL:
+            return None
+        else:
+            chars.append(char)
+    literal = "".join(chars)
+    if escaped or not literal or not literal.isascii():
+        return None
+    return literal
+
+
+def is_combinable(pattern: str) -> bool:
+    """Whether a pattern can be folded into an alternation with others."""
+    if UNCOMBINABLE.search(pattern):
+        return False
+    try:
+        # global inline flags such as (?i) are only allowed at the start
+        re.compile(f"x|(?:{pattern})", FLAGS)
+    except re.error:
+        return False
+    return True
+
+
+class _Chunk:
+    """A run of consecutive regex rules sharing one prefilter."""
+
+    def __init__(self, combinable: bool):
+        self.combinable = combinable
+        self.rules: list[tuple[int, re.Pattern]] = []
+        self.prefilter: Optional[re.Pattern] = None
+
+    def compile(self):
+        if self.combinable:
+            self.prefilter = re.compile(
+                "|".join(f"(?:{regex.pattern})" for _, regex in self.rules), FLAGS
+            )
+        else:
+            self.prefilter = self.rules[0][1]
+
+    def first_match(self, payee: str, before: int) -> Optional[int]:
+        if self.prefilter is None or not self.prefilter.search(payee):
+            return None
+        for index, regex in self.rules:
+            if index >= before:
+                break
+            if regex.search(payee):
+                return index
+        return None
+
+
+class PayeeMatcher:
+    """Index of rule patterns, answering "which rule matches first?"."""
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.patterns: list[str] = []
+        self._prefixes: dict[str, int] = {}
+        self._prefix_lengths: list[int] = []
+        self._literals: dict[str, int] = {}
+        self._literal_lengths: list[int] = []
+        self._chunks: list[_Chunk] = []
+        for pattern in patterns:
+            self._append(pattern)
+        for chunk in self._chunks:
+            chunk.compile()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _append(self, pattern: str) -> Optional[_Chunk]:
+        index = len(self.patterns)
+        self.patterns.append(pattern)
+
+        anchored = pattern.startswith("^")
+        literal = as_literal(pattern[1:] if anchored else pattern)
+        if literal is not None:
+            if anchored:
+                self._index(
+                    literal.lower(), index, self._prefixes, self._prefix_lengths
+                )
+            else:
+                self._index(
+                    literal.lower(), index, self._literals, self._literal_lengths
+                )
+            return None
+
+        combinable = is_combinable(pattern)
+        chunk = self._chunks[-1] if self._chunks else None
+        if (
+            chunk is None
+            or not combinable
+            or not chunk.combinable
+            or len(chunk.rules) >= CHUNK_SIZE
+        ):
+            chunk = _Chunk(combinable=combinable)
+            self._chunks.append(chunk)
+        chunk.rules.append((index, re.compile(pattern, FLAGS)))
+        return chunk
+
+    @staticmethod
+    def _index(literal: str, index: int, table: dict[str, int], lengths: list[int]):
+        # rules only ever get appended, so the first index seen is the lowest
+        table.setdefault(literal, index)
+        if len(literal) not in lengths:
+            lengths.append(len(literal))
+
+    def add(self, pattern: str):
+        """Add a rule after all the existing ones."""
+        chunk = self._append(pattern)
+        if chunk is not None:
+            chunk.compile()
+
+    def first_match(self, payee: str) -> Optional[int]:
+        """Return the index of the first pattern matching payee, if any."""
+        if FOLD_EXCEPTIONS.intersection(payee):
+            return self._scan(payee)
+
+        best = len(self.patterns)
+        lowered = payee.lower()
+        for length in self._prefix_lengths:
+            index = self._prefixes.get(lowered[:length], best)
+            if index < best:
+                best = index
+        for length in self._literal_lengths:
+            for start in range(len(lowered) - length + 1):
+                index = self._literals.get(lowered[start : start + length], best)
+                if index < best:
+                    best = index
+
+        for chunk in self._chunks:
+            if chunk.rules[0][0] >= best:
+                break
+            found = chunk.first_match(payee, before=best)
+            if found is not None:
+                best = found
+                break
+        return best if best < len(self.patterns) else None
+
+    def _scan(self, payee: str) -> Optional[int]:
+        """Plain linear scan, for the rare payees the indexes can't handle."""
+        for index, pattern in enumerate(self.patterns):
+            if re.search(pattern, payee, FLAGS):
+                return index
+        return None
@@ -1,5 +1,19 @@
-"""Manage local dictionary of replacements for payees as YAML files."""
+"""Manage local dictionary of replacements for payees.
 
+The rules are kept in a SQLite file per account (see bank.store). The
+YAML file with the same name is the version to read and edit by hand: it
+is imported whenever it changes, and written with export_yaml. Once it
+exists, rules learned while running are added to it as well, so that
+editing it by hand never loses them.
+
+Next to the rules, each account keeps a cache of the replacements given
+by hand (exact payee => replacement), used to run without asking
+anything, and a review file with the payees that neither the cache nor
+the rules could resolve. Replacements found by the rules are not cached,
+so that editing a rule applies to every payee it matches.
+"""
+
+from dataclasses import asdict, dataclass, replace
 from typing import Optional
 
 import re
@@ -9,8 +23,13 @@ import shutil
 
 from pydantic import BaseModel, Field, PrivateAttr
 
+from bank.matcher import PayeeMatcher
+from bank.store import RulesStore
+
 
 class PayeeRule(BaseModel):
+    """A rule as found in the YAML file, validated."""
+
     pattern: str = Field(
         default=None, description="Regex pattern that matches the payee"
     )
@@ -27,28 +46,126 @@ class PayeeRule(BaseModel):
     def search(self, payee) -> bool:
         return self._regex.search(payee)
 
+    def to_rule(self) -> "Rule":
+        return Rule(self.pattern, self.replacement)
+
+
+@dataclass(frozen=True, slots=True)
+class Rule:
+    """A rule as used at runtime: no validation, no per-rule regex.
+
+    Rules are only created from PayeeRule or from the store, which hold
+    validated rules, and matched through PayeeMatcher.
+    """
+
+    pattern: str
+    replacement: Optional[str] = None
+
 
 class Payees:
     account: str
-    payees_rules: list[PayeeRule] = []
+    payees_rules: list[Rule] = []
     prefix: Path = Path() / "payees_rules"
 
     def __init__(self, account: str):
         self.data_file: Path = self.prefix / f"payees_{account.lower()}.yaml"
         self.back_up: Path = self.prefix / f"payees_{account.lower()}.bak"
+        self.cache_file: Path = self.prefix / f"payees_{account.lower()}_cache.yaml"
+        self.review_file: Path = self.prefix / f"payees_{account.lower()}_review.yaml"
+        self.unresolved: set[str] = set()
+
+        store_file = self.prefix / f"payees_{account.lower()}.sqlite"
+        is_new = not store_file.exists()
+        self.store = RulesStore(store_file)
+        if self.yaml_changed():
+            self.import_yaml()
+        elif is_new:
+            print(f"Creating new in {self.store.path}")
+        self.payees_rules = [Rule(*row) for row in self.store.rules()]
+        self.matcher = PayeeMatcher(rule.pattern for rule in self.payees_rules)
+        self._saved_rules = len(self.payees_rules)
+        self._changed_rules: set[int] = set()
+
+        self.resolved: dict[str, str] = self.store.resolved()
+        self._changed_resolved: dict[str, str] = {}
+        self.load_resolved()
+
+    def yaml_changed(self) -> bool:
+        """Whether the YAML file was edited since it was imported or exported"""
+        return self.data_file.exists() and self.store.get_meta("yaml_mtime") != str(
+            self.data_file.stat().st_mtime_ns
+        )
 
+    def import_yaml(self):
+        """Replace the rules in the store with the ones in the YAML file"""
         try:
             raw_rules = yaml.safe_load(open(self.data_file, "r"))
-            self.payees_rules = [PayeeRule(**pr) for pr in raw_rules]
-        except (FileNotFoundError, BaseException) as exc:
-            if self.data_file.exists():
-                print(
-                    f"Error in PAYEES file {self.data_file}: saving what I found in {self.back_up}",
-                    exc,
-                )
-                shutil.copy(self.data_file, self.back_up)
-            print(f"Creating new in {self.data_file}")
-            self.save()
+            rules = [PayeeRule(**pr).to_rule() for pr in raw_rules]
+        except BaseException as exc:
+            print(
+                f"Error in PAYEES file {self.data_file}: saving what I found in {self.back_up}",
+                exc,
+            )
+            shutil.copy(self.data_file, self.back_up)
+            return
+        self.store.replace_rules((rule.pattern, rule.replacement) for rule in rules)
+        self.store.set_meta("yaml_mtime", str(self.data_file.stat().st_mtime_ns))
+        print(f"Imported {len(rules)} rules from {self.data_file}")
+
+    def export_yaml(self):
+        """Write all the rules to the YAML file, to read or edit by hand"""
+        with open(self.data_file, "w") as file:
+            file.write(yaml.safe_dump([asdict(r) for r in self.payees_rules]))
+        self.store.set_meta("yaml_mtime", str(self.data_file.stat().st_mtime_ns))
+
+    def append_yaml(self, rules: list[Rule]):
+        """Add rules to the end of the YAML file, leaving the rest as it is"""
+        text = self.data_file.read_text()
+        if text.strip() in ("", "[]"):
+            self.export_yaml()
+            return
+        with open(self.data_file, "a") as file:
+            if not text.endswith("\n"):
+                file.write("\n")
+            file.write(yaml.safe_dump([asdict(r) for r in rules]))
+        self.store.set_meta("yaml_mtime", str(self.data_file.stat().st_mtime_ns))
+
+    def sync_yaml(self):
+        """Bring the YAML file, if there is one, up to date with the store.
+        One that wasn't imported, because it's broken, is left alone
+        """
+        if not self.data_file.exists() or self.yaml_changed():
+            return
+        if any(index < self._saved_rules for index in self._changed_rules):
+            self.export_yaml()
+        elif len(self.payees_rules) > self._saved_rules:
+            self.append_yaml(self.payees_rules[self._saved_rules :])
+
+    def remember(self, payee: str, replacement: str):
+        """Add an entry to the payee cache"""
+        self.resolved[payee] = replacement
+        self._changed_resolved[payee] = replacement
+        self.unresolved.discard(payee)
+
+    def load_resolved(self):
+        """Import the old YAML cache, plus replacements filled in for review"""
+        for path in (self.cache_file, self.review_file):
+            if not path.exists():
+                continue
+            try:
+                entries = yaml.safe_load(open(path, "r")) or {}
+            except BaseException as exc:
+                print(f"Error in {path}, ignoring it", exc)
+                continue
+            for payee, replacement in entries.items():
+                if replacement:
+                    self.remember(str(payee), str(replacement))
+                elif str(payee) not in self.resolved:
+                    self.unresolved.add(str(payee))
+        if self.cache_file.exists():
+            self.store.remember(self._changed_resolved)
+            self._changed_resolved = {}
+            self.cache_file.unlink()
 
     def show_payees(self):
         """Show a list of all potential payees."""
@@ -56,31 +173,96 @@ class Payees:
         return input("\n".join(f"[ {rule} ]" for rule in sorted(uniq)) + "\n")
 
     def save(self):
-        """Save regexes to map long payee strings to sensible ones"""
+        """Save what changed in the regexes and the cache since last time"""
         try:
-            with open(self.data_file, "w") as file:
-                file.write(yaml.safe_dump([r.dict() for r in self.payees_rules]))
+            self.store.append_rules(
+                (
+                    (rule.pattern, rule.replacement)
+                    for rule in self.payees_rules[self._saved_rules :]
+                ),
+                start=self._saved_rules,
+            )
+            self.store.update_replacements(
+                (index, self.payees_rules[index].replacement)
+                for index in self._changed_rules
+                if index < self._saved_rules
+            )
+            self.store.remember(self._changed_resolved)
+            self.sync_yaml()
+            self._saved_rules = len(self.payees_rules)
+            self._changed_rules = set()
+            self._changed_resolved = {}
+
+            if self.unresolved:
+                with open(self.review_file, "w") as file:
+                    file.write(
+                        yaml.safe_dump(
+                            dict.fromkeys(sorted(self.unresolved), ""),
+                            allow_unicode=True,
+                        )
+                    )
+            else:
+                self.review_file.unlink(missing_ok=True)
 
         except Exception as exc:
-            print(f"Error saving {self.data_file}", exc)
+            print(f"Error saving {self.store.path}", exc)
             raise
 
+    def lookup(self, payee: str) -> Optional[str]:
+        """Resolve a payee without asking, or add it to the review list.
+
+        The cache is tried first, the rules only on a cache miss; rules
+        without a replacement don't count as resolved.
+        """
+        if payee in self.resolved:
+            return self.resolved[payee]
+        index = self.matcher.first_match(payee)
+        if index is not None:
+            replacement = self.payees_rules[index].replacement
+            if replacement:
+                return replacement
+        self.unresolved.add(payee)
+        return None
+
+    def review(self) -> dict[str, str]:
+        """Ask about every payee waiting for review, in one go."""
+        reviewed = {}
+        for payee in sorted(self.unresolved):
+            print("-----------------------")
+            print(payee)
+            reviewed[payee] = self.replace_payee(payee)
+        return reviewed
+
     def replace_payee(self, payee: str = "Berliner Sparkasse"):
-        for i, rule in enumerate(self.payees_rules):
-            if rule.search(payee):
-                if rule.replacement:
-                    command = input(
-                        f"{rule.replacement}? [blank to accept, or type replacement]\n"
-                    )
-                    if command:
-                        rule.replacement = command
-                    return rule.replacement
-                else:
-                    replacement = None
-                    while not replacement:
-                        replacement = input(f"type a replacement:\n")
-                    rule.replacement = replacement
-                    return replacement
+        """Ask what to replace a payee with, and remember the answer."""
+        replacement = self.ask_payee(payee)
+        self.remember(payee, replacement)
+        return replacement
+
+    def set_replacement(self, index: int, replacement: str):
+        """Change the replacement of an existing rule"""
+        self.payees_rules[index] = replace(
+            self.payees_rules[index], replacement=replacement
+        )
+        self._changed_rules.add(index)
+
+    def ask_payee(self, payee: str):
+        index = self.matcher.first_match(payee)
+        if index is not None:
+            rule = self.payees_rules[index]
+            if rule.replacement:
+                command = input(
+                    f"{rule.replacement}? [blank to accept, or type replacement]\n"
+                )
+                if command:
+                    self.set_replacement(index, command)
+                return self.payees_rules[index].replacement
+            else:
+                replacement = None
+                while not replacement:
+                    replacement = input(f"type a replacement:\n")
+                self.set_replacement(index, replacement)
+                return replacement
 
         words = re.split("([\s]+)", payee)
         replacement = input(
@@ -120,8 +302,9 @@ class Payees:
                     PayeeRule(
                         pattern=pattern,
                         replacement=replacement,
-                    )
+                    ).to_rule()
                 )
+                self.matcher.add(pattern)
             except Exception:
                 print("Invalid replacement, nothing added")
         return replacement
@@ -0,0 +1,111 @@
+"""Keep the payees rules and resolved payees of an account in SQLite.
+
+Parsing YAML is slow once there are thousands of rules, and saving used
+to dump all of them again. Here rules are kept in order by position: new
+rules are appended and changed replacements updated in place, so saving
+costs as much as what changed. The YAML file stays around as the version
+to edit by hand, see Payees.
+"""
+
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Optional
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (
+    position INTEGER PRIMARY KEY,
+    pattern TEXT NOT NULL,
+    replacement TEXT
+);
+CREATE TABLE IF NOT EXISTS resolved (
+    payee TEXT PRIMARY KEY,
+    replacement TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+Rule = tuple[str, Optional[str]]
+
+
+class RulesStore:
+    """Versioned on-disk store for the rules of one account."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self._migrate()
+
+    def _migrate(self):
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version > SCHEMA_VERSION:
+            raise ValueError(
+                f"{self.path} has version {version}, "
+                f"this code only knows up to {SCHEMA_VERSION}"
+            )
+        if version < SCHEMA_VERSION:
+            with self.connection:
+                self.connection.executescript(SCHEMA)
+                self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        self.connection.close()
+
+    def rules(self) -> list[Rule]:
+        """All the rules, in order"""
+        return self.connection.execute(
+            "SELECT pattern, replacement FROM rules ORDER BY position"
+        ).fetchall()
+
+    def replace_rules(self, rules: Iterable[Rule]):
+        """Throw away all the rules and store these instead"""
+        with self.connection:
+            self.connection.execute("DELETE FROM rules")
+            self.connection.executemany(
+                "INSERT INTO rules (position, pattern, replacement) VALUES (?, ?, ?)",
+                ((position, *rule) for position, rule in enumerate(rules)),
+            )
+
+    def append_rules(self, rules: Iterable[Rule], start: int):
+        """Add rules after the first start ones"""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO rules (position, pattern, replacement) VALUES (?, ?, ?)",
+                ((position, *rule) for position, rule in enumerate(rules, start)),
+            )
+
+    def update_replacements(self, replacements: Iterable[tuple[int, Optional[str]]]):
+        """Change the replacement of the rules at the given positions"""
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE rules SET replacement = ? WHERE position = ?",
+                ((replacement, position) for position, replacement in replacements),
+            )
+
+    def resolved(self) -> dict[str, str]:
+        """The exact payee => replacement cache"""
+        return dict(self.connection.execute("SELECT payee, replacement FROM resolved"))
+
+    def remember(self, resolved: dict[str, str]):
+        """Add or change entries in the payee cache"""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO resolved (payee, replacement) VALUES (?, ?)",
+                resolved.items(),
+            )
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
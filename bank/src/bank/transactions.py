@@ -0,0 +1,93 @@
+"""Remember which bookings were already exported, so they are only sent once.
+
+Exports from the bank overlap, and the same booking shows up in more
+than one CSV. Each booking is identified by a hash of the fields that
+make it unique; the hashes of everything exported so far are kept in a
+per account file, one per line, which is only ever appended to.
+"""
+
+from hashlib import blake2b
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pandas as pd
+
+KEY_FIELDS = ["Account", "Date", "Amount", "Reference", "Payee"]
+DATE_POSITION = KEY_FIELDS.index("Date")
+
+
+def booking_keys(
+    df: pd.DataFrame,
+    fields_map: dict[str, str],
+    counts: Optional[dict[str, int]] = None,
+) -> pd.Series:
+    """Hash the identifying fields of each booking.
+
+    Identical bookings in the same statement (two coffees on the same
+    day) are told apart by how many times they were seen before in it.
+
+    Args:
+        df (pd.DataFrame): the CSV as read, with all columns as strings
+        fields_map (dict[str, str]): YNAB column => bank column
+        counts (Optional[dict[str, int]]): how many times each booking
+            was seen in the previous chunks of the same statement. Updated
+            in place. Statements are sorted by date, so only the bookings
+            of the last date seen are remembered: identical bookings can
+            be any number of chunks apart, but always have the same date
+
+    Returns:
+        pd.Series: a hex digest per row, aligned with df
+    """
+    columns = []
+    for field in KEY_FIELDS:
+        if field in fields_map:
+            column = df[fields_map[field]].fillna("")
+        else:
+            column = pd.Series("", index=df.index, dtype=str)
+        if field == "Payee":
+            column = column.str.replace(r"\s+", " ", regex=True).str.strip()
+            column = column.str.lower()
+        columns.append(column)
+    keys = pd.Series("", index=df.index)
+    for column in columns:
+        keys = keys + column + "\x1f"
+    occurrence = keys.groupby(keys).cumcount()
+    if counts is not None:
+        occurrence += keys.map(counts).fillna(0).astype(int)
+        seen = (occurrence + 1).groupby(keys).max()
+        counts.update({str(key): int(count) for key, count in seen.items()})
+        if len(keys):
+            last_date = keys.iloc[-1].split("\x1f")[DATE_POSITION]
+            for key in list(counts):
+                if key.split("\x1f")[DATE_POSITION] != last_date:
+                    del counts[key]
+    keys = keys + occurrence.astype(str)
+    return keys.map(lambda key: blake2b(key.encode(), digest_size=16).hexdigest())
+
+
+class TransactionIndex:
+    """The keys of all the bookings exported so far for an account."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.keys: set[str] = set()
+        if path.exists():
+            with open(path, "r") as file:
+                self.keys = set(file.read().split())
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def unseen(self, keys: pd.Series) -> pd.Series:
+        """Which of the keys are not in the index yet"""
+        return ~keys.isin(self.keys)
+
+    def add(self, keys: Iterable[str]):
+        """Append new keys to the index on disk"""
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.keys]
+        if not new_keys:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as file:
+            file.write("".join(f"{key}\n" for key in new_keys))
+        self.keys.update(new_keys)
@@ -1,6 +1,8 @@
 import pytest
 from faker import Faker
 
+from bank.payees import Payees
+
 fake = Faker()
 Faker.seed(1369)
 
@@ -9,3 +11,9 @@ Faker.seed(1369)
 def fixture_fake():
     """Pass a seeded Faker instance as a fixture"""
     return fake
+
+
+@pytest.fixture(autouse=True)
+def fixture_payees_prefix(tmp_path, monkeypatch):
+    """Keep the rules, caches and indexes of every test out of the tree"""
+    monkeypatch.setattr(Payees, "prefix", tmp_path)
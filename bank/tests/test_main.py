@@ -1,11 +1,20 @@
+import pandas as pd
 import pytest
+import yaml
 from shutil import copy2 as copy
 from pathlib import Path
 
 from typer.testing import CliRunner
 
-from bank.main import app
-
+from bank.main import (
+    FIELD_NAMES,
+    app,
+    detect_fields_map,
+    find_sources,
+    replace_in_export,
+    resolve_payees,
+    transform,
+)
 
 runner = CliRunner()
 
@@ -20,3 +29,195 @@ def test_app(tmp_path):
     result = runner.invoke(app, ["--src", src_path, "--target", target_path])
     assert result.exit_code == 0
     assert "1 file(s) generated" in result.stdout
+
+
+BERLINER_CSV = "tests/fixtures/20230408-6016829526-umsatz_2.CSV"
+
+
+def read_berliner():
+    return transform(
+        pd.read_csv(BERLINER_CSV, sep=";", encoding="ISO-8859-1", dtype=str),
+        {
+            "Date": "Buchungstag",
+            "Payee": "Beguenstigter/Zahlungspflichtiger",
+            "Memo": "Verwendungszweck",
+            "Amount": "Betrag",
+            "Info": "Info",
+        },
+    )
+
+
+def test_transform():
+    """Dates, amounts and payees are normalised, scheduled bookings dropped"""
+    transformed_df = read_berliner()
+    assert "Umsatz vorgemerkt" not in transformed_df["Info"].values
+    assert transformed_df["Amount"].dtype == "float64"
+    first = transformed_df.iloc[0]
+    assert first["Date"] == "04/11/23"
+    assert first["Payee"] == "Health AG"
+    assert first["Amount"] == pytest.approx(-129.74)
+    assert not transformed_df["Payee"].str.contains("  ").any()
+
+
+def test_resolve_payees_asks_once_per_payee():
+    """Each distinct payee is resolved once, whatever the number of rows"""
+
+    class FakePayees:
+        def __init__(self):
+            self.asked = []
+
+        def replace_payee(self, payee):
+            self.asked.append(payee)
+            return payee.upper()
+
+    transformed_df = read_berliner()
+    doubled_df = pd.concat([transformed_df, transformed_df])
+    fake_payees = FakePayees()
+
+    resolved = resolve_payees(doubled_df, fake_payees)
+
+    assert sorted(fake_payees.asked) == sorted(transformed_df["Payee"].unique())
+    assert len(resolved) == len(doubled_df)
+    assert list(resolved.iloc[: len(transformed_df)]) == [
+        payee.upper() for payee in transformed_df["Payee"]
+    ]
+
+
+def test_batch_mode(tmp_path):
+    """Nothing is asked, unknown payees are left for review"""
+    target_path = tmp_path / "upload_me.csv"
+
+    result = runner.invoke(
+        app,
+        ["test", "--src", BERLINER_CSV, "--target", target_path.as_posix(), "--batch"],
+    )
+
+    assert result.exit_code == 0, result.stdout
+    assert "payee(s) to review" in result.stdout
+    review = yaml.safe_load((tmp_path / "payees_test_review.yaml").read_text())
+    assert "Health AG" in review
+    generated_df = pd.read_csv(target_path)
+    assert "Health AG" in generated_df["Payee"].values
+
+
+def test_find_sources(tmp_path):
+    """A file, a directory or a glob"""
+    for name in ["one.CSV", "two.csv", "notes.txt"]:
+        (tmp_path / name).write_text("")
+
+    assert find_sources((tmp_path / "one.CSV").as_posix()) == [tmp_path / "one.CSV"]
+    assert find_sources(tmp_path.as_posix()) == [
+        tmp_path / "one.CSV",
+        tmp_path / "two.csv",
+    ]
+    assert find_sources((tmp_path / "t*").as_posix()) == [tmp_path / "two.csv"]
+    assert find_sources((tmp_path / "nothing").as_posix()) == []
+
+
+def test_detect_fields_map(tmp_path):
+    """The format is recognised from the header, not the file name"""
+    copy(FIXTURE_CSV, tmp_path / "one.csv")
+    (tmp_path / "bad.csv").write_text("a;b;c\n")
+
+    assert detect_fields_map(Path(BERLINER_CSV)) == FIELD_NAMES["BERLINER"]
+    assert detect_fields_map(tmp_path / "one.csv") == FIELD_NAMES["CREDIT"]
+    with pytest.raises(ValueError, match="Unknown CSV format"):
+        detect_fields_map(tmp_path / "bad.csv")
+
+
+def test_many_files(tmp_path):
+    """All the files end up in the same CSV, unreadable ones are skipped"""
+    src_path = tmp_path / "dir"
+    src_path.mkdir()
+    copy(FIXTURE_CSV, src_path / "credit.csv")
+    copy(BERLINER_CSV, src_path / "berliner.csv")
+    (src_path / "bad.csv").write_text("a;b;c\n")
+    target_path = tmp_path / "upload_me.csv"
+
+    result = runner.invoke(
+        app,
+        ["test", "--src", src_path.as_posix(), "--target", target_path.as_posix()],
+    )
+
+    assert result.exit_code == 0, result.stdout
+    assert "Could not read" in result.stdout
+    assert "2 file(s) generated" in result.stdout
+    generated_df = pd.read_csv(target_path)
+    assert {"Health AG", "LIDL SAGT DANKE"}.issubset(generated_df["Payee"])
+
+
+def test_dedup(tmp_path):
+    """Bookings are exported once, even when statements overlap"""
+    src_path = tmp_path / "dir"
+    src_path.mkdir()
+    copy(BERLINER_CSV, src_path / "april.csv")
+    copy(BERLINER_CSV, src_path / "april_again.csv")
+    target_path = tmp_path / "upload_me.csv"
+    args = ["test", "--src", src_path.as_posix(), "--target", target_path.as_posix()]
+
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0, result.stdout
+    assert len(pd.read_csv(target_path)) == len(read_berliner())
+
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0, result.stdout
+    assert pd.read_csv(target_path).empty
+
+    result = runner.invoke(app, [*args, "--no-dedup"])
+    assert result.exit_code == 0, result.stdout
+    assert len(pd.read_csv(target_path)) == 2 * len(read_berliner())
+
+
+def test_chunksize(tmp_path):
+    """Streaming the CSVs gives the same result as reading them at once"""
+    src_path = tmp_path / "dir"
+    src_path.mkdir()
+    copy(BERLINER_CSV, src_path / "april.csv")
+    copy(FIXTURE_CSV, src_path / "credit.csv")
+    at_once_path = tmp_path / "at_once.csv"
+    streamed_path = tmp_path / "streamed.csv"
+    args = ["test", "--src", src_path.as_posix(), "--no-dedup"]
+
+    runner.invoke(app, [*args, "--target", at_once_path.as_posix()])
+    result = runner.invoke(
+        app, [*args, "--target", streamed_path.as_posix(), "--chunksize", "3"]
+    )
+
+    assert result.exit_code == 0, result.stdout
+    assert "2 file(s) generated" in result.stdout
+    assert streamed_path.read_text() == at_once_path.read_text()
+
+
+def test_replace_in_export(tmp_path):
+    """Payees reviewed at the end are replaced in the generated file"""
+    target_path = tmp_path / "upload_me.csv"
+    target_path.write_text(
+        "Date,Payee,Memo,Amount,Info\n"
+        "04/11/23,Health AG,x,-129.74,Umsatz gebucht\n"
+        "04/06/23,Rewe,,-2.70,Umsatz gebucht\n"
+        "04/06/23,Health AG,y,500.00,Umsatz gebucht\n"
+    )
+
+    replace_in_export(target_path.as_posix(), {"Health AG": "Health"}, chunksize=2)
+
+    assert target_path.read_text() == (
+        "Date,Payee,Memo,Amount,Info\n"
+        "04/11/23,Health,x,-129.74,Umsatz gebucht\n"
+        "04/06/23,Rewe,,-2.70,Umsatz gebucht\n"
+        "04/06/23,Health,y,500.00,Umsatz gebucht\n"
+    )
+
+
+def test_replace_in_export_keeps_text(tmp_path):
+    """Only payees change: memos and payees that look like numbers or NA stay"""
+    target_path = tmp_path / "upload_me.csv"
+    content = (
+        "Date,Payee,Memo,Amount,Info\n"
+        "04/11/23,NA,0042,-129.74,Umsatz gebucht\n"
+        "04/06/23,Health AG,,-2.70,Umsatz gebucht\n"
+    )
+    target_path.write_text(content)
+
+    replace_in_export(target_path.as_posix(), {"Health AG": "Health"}, chunksize=1)
+
+    assert target_path.read_text() == content.replace("Health AG", "Health")
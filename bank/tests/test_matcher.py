@@ -0,0 +1,84 @@
+import re
+
+import pytest
+
+from bank.matcher import PayeeMatcher, as_literal
+
+
+def linear_scan(patterns, payee):
+    """What Payees used to do: try every rule in turn"""
+    for index, pattern in enumerate(patterns):
+        if re.search(pattern, payee, re.IGNORECASE):
+            return index
+    return None
+
+
+@pytest.mark.parametrize(
+    ("pattern", "expected"),
+    [
+        ("REWE", "REWE"),
+        ("REWE SAGT DANKE\\.", "REWE SAGT DANKE."),
+        ("S-Bahn Berlin", "S-Bahn Berlin"),
+        ("REWE.*", None),
+        ("\\d+", None),
+        ("(REWE|EDEKA)", None),
+        ("Bäcker", None),
+        ("", None),
+    ],
+)
+def test_as_literal(pattern, expected):
+    """Only patterns matching a fixed ASCII string are literals"""
+    assert as_literal(pattern) == expected
+
+
+def test_first_match_wins():
+    """The lowest matching rule wins, not the leftmost match"""
+    matcher = PayeeMatcher(["DANKE", "^REWE", "rewe sagt", "^circle"])
+    assert matcher.first_match("REWE SAGT DANKE. 42400135") == 0
+    assert matcher.first_match("REWE Markt") == 1
+    assert matcher.first_match("CIRCLE PRODUCTS GMBH") == 3
+    assert matcher.first_match("S-Bahn Berlin GmbH") is None
+
+
+def test_regex_rules_keep_their_order():
+    """Literal and regex rules are interleaved by index"""
+    matcher = PayeeMatcher(["^VATTENFALL\\s+EUROPE", "^VATTENFALL", "(ab)\\1"])
+    assert matcher.first_match("VATTENFALL EUROPE SALES") == 0
+    assert matcher.first_match("VATTENFALL") == 1
+    assert matcher.first_match("xxababxx") == 2
+
+
+def test_add_rule_mid_session():
+    """Added rules are found, but never shadow the existing ones"""
+    matcher = PayeeMatcher(["^REWE"])
+    assert matcher.first_match("Health AG") is None
+
+    matcher.add("Health")
+    matcher.add("^REWE SAGT")
+    matcher.add("Bundesagentur.*Familienkasse")
+    assert len(matcher) == 4
+    assert matcher.first_match("Health AG") == 1
+    assert matcher.first_match("REWE SAGT DANKE") == 0
+    assert matcher.first_match("Bundesagentur fur Arbeit - Familienkasse") == 3
+
+
+def test_same_as_linear_scan(fake):
+    """Whatever the mix of rules, the answer is the same as a linear scan"""
+    words = [fake.unique.word().upper() for _ in range(300)]
+    patterns = []
+    for index, word in enumerate(words[:200]):
+        patterns.append(
+            [f"^{word}", word, f"{word}.*GMBH", f"^{word}\\s+\\d+", f"({word})\\1"][
+                index % 5
+            ]
+        )
+    matcher = PayeeMatcher(patterns[:100])
+    for pattern in patterns[100:]:
+        matcher.add(pattern)
+
+    payees = [
+        f"{fake.random_element(words)} {fake.random_element(words)} {fake.company()}"
+        for _ in range(500)
+    ] + ["ſtrom", "İstanbul", ""]
+    for payee in payees:
+        assert matcher.first_match(payee) == linear_scan(patterns, payee)
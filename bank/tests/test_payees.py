@@ -0,0 +1,204 @@
+import dataclasses
+import re
+
+import pytest
+import yaml
+
+from bank.payees import PayeeRule, Payees, Rule
+
+
+@pytest.fixture(name="payees")
+def fixture_payees(tmp_path, monkeypatch):
+    """Payees for a test account, with a couple of rules"""
+    monkeypatch.setattr(Payees, "prefix", tmp_path)
+    (tmp_path / "payees_test.yaml").write_text(
+        yaml.safe_dump(
+            [
+                {"pattern": "^REWE", "replacement": "Rewe"},
+                {"pattern": "^VATTENFALL", "replacement": None},
+            ]
+        )
+    )
+    return Payees(account="test")
+
+
+def test_lookup(payees):
+    """Cache first, then rules with a replacement, else it needs a review"""
+    payees.resolved["Health AG"] = "Health"
+
+    assert payees.lookup("Health AG") == "Health"
+    assert payees.lookup("REWE SAGT DANKE") == "Rewe"
+    assert "REWE SAGT DANKE" not in payees.resolved
+    assert payees.lookup("VATTENFALL EUROPE SALES") is None
+    assert payees.lookup("S-Bahn Berlin GmbH") is None
+    assert payees.unresolved == {"VATTENFALL EUROPE SALES", "S-Bahn Berlin GmbH"}
+
+
+def test_cache_and_review_survive_a_save(payees):
+    """What was resolved and what wasn't is there on the next run"""
+    payees.remember("Health AG", "Health")
+    payees.lookup("S-Bahn Berlin GmbH")
+    payees.save()
+
+    reloaded = Payees(account="test")
+    assert reloaded.resolved == {"Health AG": "Health"}
+    assert reloaded.unresolved == {"S-Bahn Berlin GmbH"}
+
+
+def test_review_file_can_be_filled_in(payees):
+    """Replacements typed in the review file end up in the cache"""
+    payees.lookup("S-Bahn Berlin GmbH")
+    payees.lookup("Health AG")
+    payees.save()
+    review = yaml.safe_load(payees.review_file.read_text())
+    review["Health AG"] = "Health"
+    payees.review_file.write_text(yaml.safe_dump(review))
+
+    reloaded = Payees(account="test")
+    assert reloaded.lookup("Health AG") == "Health"
+    assert reloaded.unresolved == {"S-Bahn Berlin GmbH"}
+
+
+def test_review(payees, monkeypatch):
+    """All payees to review are asked about once, then cached"""
+    payees.lookup("S-Bahn Berlin GmbH")
+    payees.lookup("VATTENFALL EUROPE SALES")
+    answers = iter(["", "", "Vattenfall"])
+    monkeypatch.setattr("builtins.input", lambda _: next(answers))
+
+    reviewed = payees.review()
+
+    assert reviewed == {
+        "S-Bahn Berlin GmbH": "S-Bahn Berlin GmbH",
+        "VATTENFALL EUROPE SALES": "Vattenfall",
+    }
+    assert not payees.unresolved
+    payees.save()
+    assert not payees.review_file.exists()
+    assert Payees(account="test").lookup("VATTENFALL EUROPE SALES") == "Vattenfall"
+
+
+def test_migrates_from_yaml(payees, tmp_path):
+    """The YAML rules end up in the store, and are read from there"""
+    assert [rule.pattern for rule in payees.payees_rules] == ["^REWE", "^VATTENFALL"]
+    assert (tmp_path / "payees_test.sqlite").exists()
+    assert not payees.yaml_changed()
+
+
+def test_new_rules_are_saved(payees, monkeypatch):
+    """New rules and replacements are in the store after a save"""
+    answers = iter(["", "", "Vattenfall", "Health", "1"])
+    monkeypatch.setattr("builtins.input", lambda _: next(answers))
+    payees.replace_payee("REWE SAGT DANKE")
+    payees.replace_payee("VATTENFALL EUROPE SALES")
+    payees.replace_payee("Health AG")
+    payees.save()
+
+    reloaded = Payees(account="test")
+    assert [(rule.pattern, rule.replacement) for rule in reloaded.payees_rules] == [
+        ("^REWE", "Rewe"),
+        ("^VATTENFALL", "Vattenfall"),
+        ("^Health", "Health"),
+    ]
+    assert reloaded.lookup("Health Insurance AG") == "Health"
+
+
+def test_yaml_edits_are_imported(payees, tmp_path):
+    """Editing the YAML file replaces the rules in the store"""
+    payees.export_yaml()
+    data_file = tmp_path / "payees_test.yaml"
+    rules = yaml.safe_load(data_file.read_text())
+    rules[1]["replacement"] = "Vattenfall"
+    data_file.write_text(yaml.safe_dump(rules))
+
+    reloaded = Payees(account="test")
+    assert reloaded.payees_rules[1].replacement == "Vattenfall"
+
+
+def test_learned_rules_survive_yaml_edits(payees, monkeypatch, tmp_path):
+    """Rules learned while running are added to the YAML file, so editing
+    it by hand doesn't lose them
+    """
+    answers = iter(["Health", "1"])
+    monkeypatch.setattr("builtins.input", lambda _: next(answers))
+    payees.replace_payee("Health AG")
+    payees.save()
+    data_file = tmp_path / "payees_test.yaml"
+    assert not Payees(account="test").yaml_changed()
+
+    rules = yaml.safe_load(data_file.read_text())
+    rules[1]["replacement"] = "Vattenfall"
+    data_file.write_text(yaml.safe_dump(rules))
+
+    reloaded = Payees(account="test")
+    assert [(rule.pattern, rule.replacement) for rule in reloaded.payees_rules] == [
+        ("^REWE", "Rewe"),
+        ("^VATTENFALL", "Vattenfall"),
+        ("^Health", "Health"),
+    ]
+
+
+def test_rule_edits_apply_to_payees_seen_before(payees, tmp_path):
+    """Replacements found by a rule are not cached over an edit of it"""
+    assert payees.lookup("REWE SAGT DANKE") == "Rewe"
+    payees.save()
+    data_file = tmp_path / "payees_test.yaml"
+    rules = yaml.safe_load(data_file.read_text())
+    rules[0]["replacement"] = "REWE Markt"
+    data_file.write_text(yaml.safe_dump(rules))
+
+    assert Payees(account="test").lookup("REWE SAGT DANKE") == "REWE Markt"
+
+
+def test_changed_replacements_are_written_to_yaml(payees, monkeypatch, tmp_path):
+    """Changing the replacement of a rule rewrites the YAML file"""
+    monkeypatch.setattr("builtins.input", lambda _: "Vattenfall")
+    payees.replace_payee("VATTENFALL EUROPE SALES")
+    payees.save()
+
+    rules = yaml.safe_load((tmp_path / "payees_test.yaml").read_text())
+    assert rules[1] == {"pattern": "^VATTENFALL", "replacement": "Vattenfall"}
+
+
+def test_broken_yaml_keeps_the_store(payees, tmp_path):
+    """A broken YAML file is backed up and ignored"""
+    (tmp_path / "payees_test.yaml").write_text("- pattern: [")
+
+    reloaded = Payees(account="test")
+    assert len(reloaded.payees_rules) == 2
+    assert (tmp_path / "payees_test.bak").exists()
+
+
+def test_migrates_yaml_cache(payees, tmp_path):
+    """The cache used to be a YAML file"""
+    (tmp_path / "payees_test_cache.yaml").write_text(
+        yaml.safe_dump({"Health AG": "Health"})
+    )
+
+    reloaded = Payees(account="test")
+    assert reloaded.lookup("Health AG") == "Health"
+    assert not (tmp_path / "payees_test_cache.yaml").exists()
+    assert Payees(account="test").resolved == {"Health AG": "Health"}
+
+
+def test_rules_are_immutable(payees):
+    """Changing a replacement swaps the rule for a new one"""
+    rule = payees.payees_rules[1]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        rule.replacement = "Vattenfall"
+
+    payees.set_replacement(1, "Vattenfall")
+
+    assert rule.replacement is None
+    assert payees.payees_rules[1] == Rule("^VATTENFALL", "Vattenfall")
+
+
+def test_invalid_rules_are_not_added(payees, monkeypatch):
+    """Typed in patterns are validated like the ones in the YAML file"""
+    answers = iter(["Health", "^Health ("])
+    monkeypatch.setattr("builtins.input", lambda _: next(answers))
+
+    assert payees.replace_payee("Health AG") == "Health"
+    assert len(payees.payees_rules) == 2
+    with pytest.raises(re.error):
+        PayeeRule(pattern="^Health (")
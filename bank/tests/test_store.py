@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from bank.store import SCHEMA_VERSION, RulesStore
+
+
+def test_rules(tmp_path):
+    """Rules keep their order, and can be appended to or updated"""
+    store = RulesStore(tmp_path / "payees_test.sqlite")
+    store.replace_rules([("^REWE", "Rewe"), ("^VATTENFALL", None)])
+    store.append_rules([("Health", "Health")], start=2)
+    store.update_replacements([(1, "Vattenfall")])
+    store.close()
+
+    reopened = RulesStore(tmp_path / "payees_test.sqlite")
+    assert reopened.rules() == [
+        ("^REWE", "Rewe"),
+        ("^VATTENFALL", "Vattenfall"),
+        ("Health", "Health"),
+    ]
+    reopened.replace_rules([("^LIDL", "Lidl")])
+    assert reopened.rules() == [("^LIDL", "Lidl")]
+
+
+def test_resolved_and_meta(tmp_path):
+    """The payee cache and bits of metadata"""
+    store = RulesStore(tmp_path / "payees_test.sqlite")
+    store.remember({"REWE SAGT DANKE": "Rewe", "Health AG": "Health"})
+    store.remember({"Health AG": "Health Insurance"})
+    store.set_meta("yaml_mtime", "123")
+
+    assert store.resolved() == {
+        "REWE SAGT DANKE": "Rewe",
+        "Health AG": "Health Insurance",
+    }
+    assert store.get_meta("yaml_mtime") == "123"
+    assert store.get_meta("nope") is None
+
+
+def test_newer_version(tmp_path):
+    """A store written by a newer version is not touched"""
+    path = tmp_path / "payees_test.sqlite"
+    connection = sqlite3.connect(path)
+    connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    connection.close()
+
+    with pytest.raises(ValueError, match="version"):
+        RulesStore(path)
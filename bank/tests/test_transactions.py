@@ -0,0 +1,114 @@
+import pandas as pd
+
+from bank.transactions import TransactionIndex, booking_keys
+
+FIELDS_MAP = {
+    "Date": "Buchungstag",
+    "Payee": "Beguenstigter/Zahlungspflichtiger",
+    "Amount": "Betrag",
+    "Account": "Auftragskonto",
+    "Reference": "Kundenreferenz (End-to-End)",
+}
+
+
+def bookings(*rows):
+    return pd.DataFrame(
+        [
+            dict(zip(FIELDS_MAP.values(), row), Verwendungszweck="whatever")
+            for row in rows
+        ]
+    )
+
+
+def test_booking_keys():
+    """Same booking, same key; payee spacing and case don't matter"""
+    first = bookings(("31.03.23", "REWE  SAGT DANKE", "-4,47", "DE98", "5604"))
+    second = bookings(
+        ("06.04.23", "Health AG", "-129,74", "DE98", None),
+        ("31.03.23", "Rewe sagt danke", "-4,47", "DE98", "5604"),
+    )
+
+    assert booking_keys(first, FIELDS_MAP)[0] == booking_keys(second, FIELDS_MAP)[1]
+    assert booking_keys(second, FIELDS_MAP).nunique() == 2
+
+
+def test_identical_bookings_in_a_statement():
+    """Two identical bookings in the same statement are both kept"""
+    coffee = ("31.03.23", "CIRCLE PRODUCTS GMBH", "-2,77", "DE98", "")
+    keys = booking_keys(bookings(coffee, coffee), FIELDS_MAP)
+
+    assert keys.nunique() == 2
+    assert keys[0] == booking_keys(bookings(coffee), FIELDS_MAP)[0]
+
+
+def test_keys_in_chunks():
+    """Reading a statement in chunks doesn't change the keys"""
+    coffee = ("31.03.23", "CIRCLE PRODUCTS GMBH", "-2,77", "DE98", "")
+    df = bookings(
+        ("30.03.23", "REWE", "-4,47", "DE98", "1"),
+        coffee,
+        coffee,
+        coffee,
+        ("29.03.23", "REWE", "-4,47", "DE98", "2"),
+    )
+    counts = {}
+    chunked = pd.concat(
+        [
+            booking_keys(df.iloc[start : start + 2], FIELDS_MAP, counts)
+            for start in [0, 2, 4]
+        ]
+    )
+
+    assert list(chunked) == list(booking_keys(df, FIELDS_MAP))
+
+
+def test_identical_bookings_chunks_apart():
+    """Identical bookings more than a chunk apart still get their own keys"""
+    coffee = ("31.03.23", "CIRCLE PRODUCTS GMBH", "-2,77", "DE98", "")
+    df = bookings(
+        coffee,
+        ("31.03.23", "REWE", "-4,47", "DE98", "1"),
+        ("31.03.23", "REWE", "-4,47", "DE98", "2"),
+        ("31.03.23", "REWE", "-4,47", "DE98", "3"),
+        coffee,
+    )
+    counts = {}
+    chunked = pd.concat(
+        [
+            booking_keys(df.iloc[start : start + 2], FIELDS_MAP, counts)
+            for start in [0, 2, 4]
+        ]
+    )
+
+    assert chunked.nunique() == 5
+    assert list(chunked) == list(booking_keys(df, FIELDS_MAP))
+
+
+def test_missing_key_fields():
+    """Formats without some of the fields still get keys"""
+    fields_map = {"Date": "Buchungstag", "Payee": "Beguenstigter/Zahlungspflichtiger"}
+    keys = booking_keys(
+        bookings(("31.03.23", "REWE", "-4,47"), ("01.04.23", "REWE", "-4,47")),
+        fields_map,
+    )
+    assert keys.nunique() == 2
+
+    keys = booking_keys(
+        bookings(("31.03.23", "REWE", "-4,47"), ("01.04.23", "REWE", "-4,47")),
+        {"Date": "Buchungstag"},
+    )
+    assert keys.nunique() == 2
+
+
+def test_transaction_index(tmp_path):
+    """Keys are appended, and known on the next run"""
+    path = tmp_path / "transactions_test.idx"
+    transactions = TransactionIndex(path)
+    assert len(transactions) == 0
+
+    transactions.add(["a", "b", "a"])
+    transactions.add(["b", "c"])
+
+    assert path.read_text() == "a\nb\nc\n"
+    reloaded = TransactionIndex(path)
+    assert list(reloaded.unseen(pd.Series(["a", "d", "c"]))) == [False, True, False]
@@ -0,0 +1,95 @@
+"""Copying a synthetic tree of many small files and a few large ones,
+with copy_files versus sync_folders. Use --dest on another device to
+leave reflinks out of it; the source is likely in the page cache, so
+this measures the destination more than the source.
+
+Usage: python benchmarks/bench_copy.py [--small 5000] [--small-size 32K]
+    [--large 2] [--large-size 2G] [--dest /Volumes/USB/bench]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from slow_copying import MB, parse_size, sync_folders  # noqa: E402
+
+# large files are written from this much random data, over and over
+BLOCK = 16 * MB
+
+
+def make_tree(folder: Path, small: int, small_size: int, large: int, large_size: int):
+    for index in range(small):
+        album = folder / f"album {index // 100:03}"
+        album.mkdir(parents=True, exist_ok=True)
+        (album / f"{index % 100:02} track.mp3").write_bytes(os.urandom(small_size))
+    block = os.urandom(BLOCK)
+    for index in range(large):
+        with open(folder / f"{index:02} film.mp4", "wb") as file:
+            for _ in range(0, large_size, BLOCK):
+                file.write(block)
+
+
+def measure(label: str, copy, source: Path, destination: Path):
+    shutil.rmtree(destination, ignore_errors=True)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        copy(source, destination)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14}{elapsed:10.2f} s")
+    shutil.rmtree(destination)
+
+
+def copy_files(files_to_copy, without_source, destination_folder):
+    """the copy loop slow_copying.py started from, kept here to compare"""
+    print(without_source)
+    for source_path, fragment in zip(files_to_copy, without_source):
+        if source_path.is_dir() or source_path.as_posix().endswith(".DS_Store"):
+            continue
+        destination_path = destination_folder / fragment
+        destination_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source_path, destination_path)
+
+
+def with_copy_files(source: Path, destination: Path):
+    """the way main used to call it"""
+    files_to_copy = sorted(list(source.glob("**/*")))
+    without_source = [f.relative_to(source).as_posix() for f in files_to_copy]
+    copy_files(files_to_copy, without_source, destination)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--small", type=int, default=5000)
+    parser.add_argument("--small-size", type=parse_size, default=32 * 1024)
+    parser.add_argument("--large", type=int, default=2)
+    parser.add_argument("--large-size", type=parse_size, default=2 * 1024 * MB)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dest", type=Path, help="where to copy to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = Path(tmp_dir) / "source"
+        destination = (args.dest or Path(tmp_dir)) / "destination"
+        make_tree(source, args.small, args.small_size, args.large, args.large_size)
+        print(
+            f"{args.small} files of {args.small_size / 1024:.0f} KB, "
+            f"{args.large} of {args.large_size / MB:.0f} MB"
+        )
+        measure("copy_files", with_copy_files, source, destination)
+        measure(
+            "sync_folders",
+            lambda source, destination: sync_folders(source, destination, args.workers),
+            source,
+            destination,
+        )
+
+
+if __name__ == "__main__":
+    main()
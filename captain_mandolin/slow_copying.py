@@ -1,51 +1,752 @@
+"""
+Copies the files of a folder into another one, for example a media
+library onto a USB stick for the car stereo. Cheap players play the
+files in the order they were created on FAT, so the files and folders
+of each folder are created one at a time, in natural order: "Track 2"
+before "Track 10".
+
+The source folder is walked as it is copied rather than listed up
+front. Each folder is copied by one of a pool of workers, which hands
+each subfolder over to another worker once it has created it, so that
+separate folders are copied in parallel. Files whose size
+and modification time already match at the destination are skipped.
+Each file copied is recorded in a manifest at the destination, so that
+an interrupted run resumes where it stopped without looking at the
+files already there; the manifest is removed once a run completes.
+
+Slow devices like SD cards stall when copied to as fast as possible, so
+the pace can be limited to a number of bytes and of files a second. The
+files are then copied in chunks of --buffer-size, optionally synced to
+disk every --fsync-every bytes rather than left in the write cache.
+Sizes take a K, M or G suffix.
+
+File data is copied by the kernel where it can: cloned when source and
+destination are on the same filesystem and it supports reflinks,
+otherwise with os.copy_file_range or os.sendfile, and only as a last
+resort read and written through a buffer. Small files are read and
+written in one go. Permissions and
+times are copied afterwards. benchmarks/bench_copy.py compares this
+with the single-threaded shutil.copy2 loop the script used to have.
+
+With --dedup, a file is not copied when a file with the same content is
+already at the destination: it is hardlinked to it instead, or left out
+altogether with --dedup skip. Only files of the same size are compared,
+first by a hash of their first and last bytes, then by a hash of all of
+them, computed in a pool of processes. Hashes are kept in --hash-cache
+for as long as the size and modification time of their file stay the
+same, so that later runs don't read the files again. Linked files share
+one modification time, so a destination file with the same content as
+its source counts as up to date whatever its time. A file linked to
+others is never written into: it is replaced by a new copy instead.
+
+    ❯ python slow_copying.py -s ~/Music/Mandolin -d /Volumes/CAR --bandwidth 4M
+    -> Album 1/01 Intro.mp3
+    ...
+    == 120.0 MB in 31 files, 4.0 MB/s now, 3.9 MB/s overall
+    ...
+    Copied 120 files, skipped 1324
+    == 480.2 MB in 120 files, 3.9 MB/s overall
+"""
+
 from pathlib import Path
-import shutil
 import argparse
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from queue import SimpleQueue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    # no reflinks on Windows
+    fcntl = None
+
+IGNORED = {".DS_Store"}
+MANIFEST_FILE = ".slow_copying.manifest"
+
+# FAT only keeps modification times to the nearest 2 seconds
+MTIME_TOLERANCE = 2
+
+# Folders are copied by this many workers at a time. Whatever the number,
+# the files and subfolders of a folder are created in order: only
+# separate folders are copied at the same time
+MAX_WORKERS = 4
+
+# Chunks are copied this many bytes at a time when the pace is limited or
+# the kernel can't copy them. The throughput is printed every
+# REPORT_INTERVAL seconds
+BUFFER_SIZE = 1024 * 1024
+REPORT_INTERVAL = 5
+MB = 1024 * 1024
+UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+# Files smaller than SMALL_FILE are copied with a single read and write.
+# Larger ones are copied by the kernel ZERO_COPY_CHUNK bytes at a time,
+# or buffer size if limited
+SMALL_FILE = 1024 * 1024
+ZERO_COPY_CHUNK = 64 * 1024 * 1024
+
+# the ioctl cloning a whole file on Linux, from linux/fs.h
+FICLONE = 0x40049409
+
+# what a filesystem or an OS says when it can't do a zero-copy transfer
+UNSUPPORTED = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+}
+
+# The partial hash is of the first and last PARTIAL_SIZE bytes of a file
+DEDUP_HARDLINK = "hardlink"
+DEDUP_SKIP = "skip"
+HASH_CACHE_FILE = Path.home() / ".slow_copying.sqlite"
+PARTIAL_SIZE = 64 * 1024
+HASH_PARTIAL = "partial"
+HASH_FULL = "full"
+HASH_COMMIT_EVERY = 100
+
+
+def clone(source, dest) -> bool:
+    """share the blocks of source with dest, on filesystems with reflinks
+    like Btrfs or XFS. Return false if it can't
+    """
+    if (
+        fcntl is None
+        or os.fstat(source.fileno()).st_dev != os.fstat(dest.fileno()).st_dev
+    ):
+        return False
+    try:
+        fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+    except OSError as e:
+        if e.errno not in UNSUPPORTED:
+            raise
+        return False
+    return True
+
+
+def copy_file_range(source_fd: int, dest_fd: int, count: int, offset: int) -> int:
+    return os.copy_file_range(source_fd, dest_fd, count, offset, offset)
+
+
+def sendfile(source_fd: int, dest_fd: int, count: int, offset: int) -> int:
+    return os.sendfile(dest_fd, source_fd, offset, count)
+
+
+KERNEL_COPIES = [
+    copy
+    for copy, name in ((copy_file_range, "copy_file_range"), (sendfile, "sendfile"))
+    if hasattr(os, name)
+]
+
+
+def kernel_copy(source, dest, size: int, chunk_size: int, copied) -> bool:
+    """copy the size bytes of source to dest without the data going
+    through user space, calling copied with the size of each chunk.
+    Return false if neither way gets to the end: some filesystems don't
+    support copy_file_range but return 0 rather than an error. Both files
+    are then left at where it stopped, for the rest to be copied another
+    way
+    """
+    offset = 0
+    for copy in KERNEL_COPIES:
+        # sendfile writes at the position of dest, copy_file_range doesn't
+        dest.seek(offset)
+        try:
+            while offset < size:
+                count = copy(source.fileno(), dest.fileno(), chunk_size, offset)
+                if not count:
+                    break
+                offset += count
+                copied(count)
+        except OSError as e:
+            if offset or e.errno not in UNSUPPORTED:
+                raise
+        if offset == size:
+            return True
+    source.seek(offset)
+    dest.seek(offset)
+    return False
+
+
+def buffered_copy(source, dest, buffer_size: int, copied):
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        size = source.readinto(buffer)
+        if not size:
+            return
+        dest.write(view[:size])
+        copied(size)
+
+
+def parse_size(size: str) -> int:
+    """a number of bytes, with an optional K, M or G suffix"""
+    size = size.strip().upper().removesuffix("B")
+    if size and size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+class TokenBucket:
+    """rate tokens a second, of which up to burst can be saved up. Takers
+    wait until the tokens they take are there
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, tokens: float):
+        """the tokens are taken straight away, going into debt if need be,
+        so that each taker waits for its turn
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Progress:
+    """the bytes and files copied so far, printed as they go"""
+
+    def __init__(self, interval: float = REPORT_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = self.reported = time.monotonic()
+        self.bytes = self.reported_bytes = 0
+        self.files = 0
+
+    def add(self, size: int = 0, files: int = 0):
+        with self.lock:
+            self.bytes += size
+            self.files += files
+            now = time.monotonic()
+            if now - self.reported < self.interval:
+                return
+            current = (self.bytes - self.reported_bytes) / (now - self.reported)
+            self.reported, self.reported_bytes = now, self.bytes
+            print(f"== {self.summary()}, {current / MB:.1f} MB/s now, ", end="")
+            print(f"{self.overall() / MB:.1f} MB/s overall")
+
+    def summary(self) -> str:
+        return f"{self.bytes / MB:.1f} MB in {self.files} files"
+
+    def overall(self) -> float:
+        return self.bytes / max(time.monotonic() - self.started, 1e-9)
+
+
+class Pace:
+    """how files are copied: as fast as possible, or in chunks of
+    buffer_size at no more than bytes_per_second and files_per_second.
+    With fsync_every, the destination is synced to disk every that many
+    bytes
+    """
+
+    def __init__(
+        self,
+        bytes_per_second: Optional[int] = None,
+        files_per_second: Optional[float] = None,
+        buffer_size: int = BUFFER_SIZE,
+        fsync_every: Optional[int] = None,
+    ):
+        self.bytes = None
+        if bytes_per_second:
+            # a whole chunk must fit in the bucket
+            self.bytes = TokenBucket(
+                bytes_per_second, max(bytes_per_second, buffer_size)
+            )
+        self.files = TokenBucket(files_per_second, 1) if files_per_second else None
+        self.buffer_size = buffer_size
+        self.fsync_every = fsync_every
+        self.progress = Progress()
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.bytes or self.files or self.fsync_every)
+
+    def copy(self, source_path, destination_path, size: int):
+        """copy the data, then the metadata"""
+        if self.files:
+            self.files.take(1)
+        unsynced = 0
+
+        def copied(chunk: int):
+            nonlocal unsynced
+            if self.bytes:
+                self.bytes.take(chunk)
+            self.progress.add(chunk)
+            unsynced += chunk
+            if self.fsync_every and unsynced >= self.fsync_every:
+                dest.flush()
+                os.fsync(dest.fileno())
+                unsynced = 0
+
+        chunk_size = self.buffer_size if self.limited else ZERO_COPY_CHUNK
+        target_path = destination_path
+        if is_linked(destination_path):
+            # writing in place would change every path linked to it
+            destination_path = temporary_path(target_path)
+        with open(source_path, "rb") as source, open(destination_path, "wb") as dest:
+            if size < SMALL_FILE:
+                data = source.read()
+                dest.write(data)
+                copied(len(data))
+            elif clone(source, dest):
+                # no data written
+                self.progress.add(size)
+            elif not kernel_copy(source, dest, size, chunk_size, copied):
+                buffered_copy(source, dest, self.buffer_size, copied)
+            if self.fsync_every and unsynced:
+                dest.flush()
+                os.fsync(dest.fileno())
+        shutil.copystat(source_path, destination_path)
+        if destination_path != target_path:
+            os.replace(destination_path, target_path)
+        self.progress.add(files=1)
+
 
+def is_linked(path) -> bool:
+    """whether other paths share the inode of path"""
+    try:
+        return os.stat(path).st_nlink > 1
+    except FileNotFoundError:
+        return False
 
-def copy_files(files_to_copy, without_source, destination_folder):
-    print(without_source)
-    for source_path, fragment in zip(files_to_copy, without_source):
-        # debug
-        # print(source_path)
-        # print(fragment)
-        # print("-")
 
-        if source_path.is_dir() or source_path.as_posix().endswith(".DS_Store"):
-            continue
-        destination_path = destination_folder / fragment
-        destination_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(source_path, destination_path)
+def temporary_path(path) -> Path:
+    """where to write a new version of path before replacing it"""
+    path = Path(path)
+    return path.with_name(f".{path.name}.tmp")
+
+
+def natural_key(name: str):
+    """ "Track 2" before "Track 10", and case insensitive"""
+    parts = re.split(r"(\d+)", name.casefold())
+    parts[1::2] = map(int, parts[1::2])
+    return (parts, name)
+
+
+def list_folder(folder) -> list:
+    """the entries of folder worth copying, in natural order"""
+    with os.scandir(folder) as entries:
+        return sorted(
+            (entry for entry in entries if entry.name not in IGNORED),
+            key=lambda entry: natural_key(entry.name),
+        )
+
+
+def walk(folder: Path, fragment: Path = Path()):
+    """yield each file under folder with its path relative to it, in
+    natural order, one folder at a time
+    """
+    for entry in list_folder(folder):
+        if entry.is_dir():
+            yield from walk(Path(entry.path), fragment / entry.name)
+        else:
+            yield entry, fragment / entry.name
+
+
+def is_up_to_date(source_stat: os.stat_result, destination_path: Path) -> bool:
+    try:
+        destination_stat = destination_path.stat()
+    except FileNotFoundError:
+        return False
+    return (
+        destination_stat.st_size == source_stat.st_size
+        and abs(destination_stat.st_mtime - source_stat.st_mtime) <= MTIME_TOLERANCE
+    )
+
+
+class Manifest:
+    """the files copied so far, with their size and modification time,
+    appended to a file as they are copied
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.copied = {}
+        if path.exists():
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line of an interrupted run
+                        continue
+                    self.copied[entry["path"]] = (entry["size"], entry["mtime"])
+        self.file = open(path, "a")
+
+    def has(self, fragment: Path, stat: os.stat_result) -> bool:
+        return self.copied.get(fragment.as_posix()) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    def add(self, fragment: Path, stat: os.stat_result):
+        entry = {
+            "path": fragment.as_posix(),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def close(self, finished: bool = False):
+        """keep the manifest unless the run finished"""
+        self.file.close()
+        if finished:
+            self.path.unlink()
+
+
+def partial_hash(path: str) -> str:
+    with open(path, "rb") as file:
+        digest = hashlib.blake2b(file.read(PARTIAL_SIZE))
+        if file.seek(0, os.SEEK_END) > PARTIAL_SIZE:
+            file.seek(-min(PARTIAL_SIZE, file.tell() - PARTIAL_SIZE), os.SEEK_END)
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def full_hash(path: str) -> str:
+    digest = hashlib.blake2b()
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb") as file:
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                return digest.hexdigest()
+            digest.update(view[:size])
+
+
+class HashCache:
+    """the hashes of files, by path, for as long as their size and
+    modification time stay the same
+    """
+
+    def __init__(self, path: Path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT, kind TEXT, size INTEGER, mtime INTEGER, hash TEXT,
+                PRIMARY KEY (path, kind)
+            )""")
+        self.uncommitted = 0
+
+    def get(self, path: str, stat: os.stat_result, kind: str) -> Optional[str]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT hash FROM hashes"
+                " WHERE path = ? AND kind = ? AND size = ? AND mtime = ?",
+                (path, kind, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, path: str, stat: os.stat_result, kind: str, value: str):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                (path, kind, stat.st_size, stat.st_mtime_ns, value),
+            )
+            self.uncommitted += 1
+            if self.uncommitted >= HASH_COMMIT_EVERY:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class Dedup:
+    """the files at the destination by size, to find one with the same
+    content as a file about to be copied, and hardlink to it or skip it
+    """
+
+    def __init__(self, destination_folder: Path, mode: str, cache_path: Path):
+        self.mode = mode
+        self.cache = HashCache(cache_path)
+        self.hashers = ProcessPoolExecutor()
+        self.lock = threading.Lock()
+        self.by_size = defaultdict(list)
+        self.linked = self.skipped = 0
+        for entry, _ in walk(destination_folder):
+            if entry.name != MANIFEST_FILE:
+                self.add(entry.path, entry.stat().st_size)
+
+    def add(self, path: str, size: int):
+        with self.lock:
+            self.by_size[size].append(os.path.abspath(path))
+
+    def hash(self, path: str, stat: os.stat_result, kind: str) -> str:
+        value = self.cache.get(path, stat, kind)
+        if value is None:
+            if kind == HASH_PARTIAL:
+                value = partial_hash(path)
+            else:
+                value = self.hashers.submit(full_hash, path).result()
+            self.cache.put(path, stat, kind, value)
+        return value
+
+    def find(self, path: str, stat: os.stat_result) -> Optional[str]:
+        """a destination file with the same content as path, if any"""
+        with self.lock:
+            candidates = list(self.by_size.get(stat.st_size, ()))
+        if not candidates:
+            return None
+        path = os.path.abspath(path)
+        for candidate in candidates:
+            try:
+                candidate_stat = os.stat(candidate)
+            except FileNotFoundError:
+                continue
+            if self.same_content(candidate, candidate_stat, path, stat):
+                return candidate
+        return None
+
+    def same_content(self, path, stat, other, other_stat) -> bool:
+        return all(
+            self.hash(path, stat, kind) == self.hash(other, other_stat, kind)
+            for kind in (HASH_PARTIAL, HASH_FULL)
+        )
+
+    def is_up_to_date(self, path: str, stat: os.stat_result, destination_path):
+        """whether destination_path has the same content as path. Linked
+        files share one modification time, so theirs doesn't tell
+        """
+        try:
+            destination_stat = os.stat(destination_path)
+        except FileNotFoundError:
+            return False
+        return destination_stat.st_size == stat.st_size and self.same_content(
+            os.path.abspath(destination_path),
+            destination_stat,
+            os.path.abspath(path),
+            stat,
+        )
+
+    def dedup(self, path: str, stat: os.stat_result, destination_path: Path):
+        """hardlink or skip path if its content is already there. Return
+        false if it should be copied
+        """
+        existing = self.find(path, stat)
+        if existing is None:
+            return False
+        if self.mode == DEDUP_SKIP:
+            print(f"-> Skipping {destination_path}, same as {existing}")
+            self.skipped += 1
+            return True
+        try:
+            os.link(existing, destination_path)
+        except OSError as e:
+            # no hardlinks on FAT, nor across filesystems
+            print(f">>>> Can't link {destination_path} to {existing}: {e}")
+            return False
+        print(f"-> Linked {destination_path} to {existing}")
+        self.linked += 1
+        return True
+
+    def close(self):
+        self.hashers.shutdown()
+        self.cache.close()
+
+
+def copy_file(
+    entry: os.DirEntry,
+    fragment: Path,
+    destination_path: Path,
+    manifest,
+    pace,
+    dedup=None,
+):
+    """copy a file unless it's already there. Return true if it was copied"""
+    stat = entry.stat()
+    if manifest.has(fragment, stat) or is_up_to_date(stat, destination_path):
+        return False
+    if dedup is not None and dedup.is_up_to_date(entry.path, stat, destination_path):
+        manifest.add(fragment, stat)
+        return False
+    if dedup is not None and dedup.dedup(entry.path, stat, destination_path):
+        manifest.add(fragment, stat)
+        return False
+    print(f"-> {fragment.as_posix()}")
+    pace.copy(entry.path, destination_path, stat.st_size)
+    manifest.add(fragment, stat)
+    if dedup is not None:
+        dedup.add(destination_path, stat.st_size)
+    return True
+
+
+class OrderedCopy:
+    """copies each folder in a task of its own, creating its files and
+    subfolders one at a time in natural order. Each subfolder is copied in
+    a new task once created, in parallel with the rest
+    """
+
+    def __init__(self, executor, destination_folder: Path, manifest, pace, dedup):
+        self.executor = executor
+        self.destination_folder = destination_folder
+        self.manifest = manifest
+        self.pace = pace
+        self.dedup = dedup
+        self.pending = SimpleQueue()
+
+    def submit(self, folder, fragment: Path):
+        self.pending.put(self.executor.submit(self.copy_folder, folder, fragment))
+
+    def copy_folder(self, folder, fragment: Path) -> list:
+        """return whether each file of the folder was copied"""
+        results = []
+        for entry in list_folder(folder):
+            destination_path = self.destination_folder / fragment / entry.name
+            if entry.is_dir():
+                destination_path.mkdir(exist_ok=True)
+                self.submit(entry.path, fragment / entry.name)
+                continue
+            results.append(
+                copy_file(
+                    entry,
+                    fragment / entry.name,
+                    destination_path,
+                    self.manifest,
+                    self.pace,
+                    self.dedup,
+                )
+            )
+        return results
+
+    def run(self, source_folder: Path) -> list:
+        """copy source_folder, and return whether each file was copied"""
+        self.submit(source_folder, Path())
+        results = []
+        # a task queues the tasks of its subfolders before it finishes, so
+        # once the queue is empty they are all done
+        while not self.pending.empty():
+            results.extend(self.pending.get().result())
+        return results
+
+
+def sync_folders(
+    source_folder: Path,
+    destination_folder: Path,
+    max_workers: int = MAX_WORKERS,
+    pace: Optional[Pace] = None,
+    dedup: Optional[str] = None,
+    hash_cache: Path = HASH_CACHE_FILE,
+):
+    """copy the files of source_folder missing or different in
+    destination_folder. Return how many were copied and how many skipped,
+    deduplicated ones included
+    """
+    pace = pace or Pace()
+    destination_folder.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(destination_folder / MANIFEST_FILE)
+    if dedup is not None:
+        dedup = Dedup(destination_folder, dedup, hash_cache)
+    finished = False
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            ordered_copy = OrderedCopy(
+                executor, destination_folder, manifest, pace, dedup
+            )
+            results = ordered_copy.run(source_folder)
+        finished = True
+    finally:
+        manifest.close(finished)
+        if dedup is not None:
+            dedup.close()
+            print(f"Linked {dedup.linked} files, left out {dedup.skipped}")
+    copied = sum(results)
+    return (copied, len(results) - copied)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", "--src", help="Path to the source folder")
     parser.add_argument("-d", "--dest", help="Path to the destination folder")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="How many folders to copy at a time; each is still copied in order",
+    )
+    parser.add_argument(
+        "--bandwidth", type=parse_size, help="Most bytes to copy a second"
+    )
+    parser.add_argument(
+        "--files-per-second", type=float, help="Most files to copy a second"
+    )
+    parser.add_argument(
+        "--buffer-size",
+        type=parse_size,
+        default=BUFFER_SIZE,
+        help="Bytes to read and write at a time when the pace is limited",
+    )
+    parser.add_argument(
+        "--fsync-every", type=parse_size, help="Sync to disk every that many bytes"
+    )
+    parser.add_argument(
+        "--dedup",
+        nargs="?",
+        const=DEDUP_HARDLINK,
+        choices=[DEDUP_HARDLINK, DEDUP_SKIP],
+        help="Hardlink (default) or skip files already at the destination",
+    )
+    parser.add_argument(
+        "--hash-cache",
+        type=Path,
+        default=HASH_CACHE_FILE,
+        help=f"Where to keep the hashes for --dedup, {HASH_CACHE_FILE} by default",
+    )
     args = parser.parse_args()
 
-    source_folder = args.src
-    destination_folder = Path(args.dest.rstrip("/"))
-
-    if source_folder is None:
+    if args.src is None:
         raise ValueError("Missing --src (source folder)")
 
-    if destination_folder is None:
-        raise ValueError("Missing --dest (destinatiobn folder)")
+    if args.dest is None:
+        raise ValueError("Missing --dest (destination folder)")
 
-    files_to_copy = sorted(list(Path(source_folder).glob("**/*")))
-    start = len(source_folder)
-    without_source = [f.as_posix()[start:] for f in files_to_copy]
-    copy_files(files_to_copy, without_source, destination_folder)
+    pace = Pace(
+        args.bandwidth, args.files_per_second, args.buffer_size, args.fsync_every
+    )
+    copied, skipped = sync_folders(
+        Path(args.src),
+        Path(args.dest),
+        args.workers,
+        pace,
+        args.dedup,
+        args.hash_cache,
+    )
+    print(f"Copied {copied} files, skipped {skipped}")
+    print(
+        f"== {pace.progress.summary()}, {pace.progress.overall() / MB:.1f} MB/s overall"
+    )
 
 
 if __name__ == "__main__":
     main()
-
-
-# if __name__ == "__main__":
-# files_to_copy = ["file1.txt", "file2.txt", "file3.txt"]
-# source_folder = "/path/to/source/folder"
-# destination_folder = "/path/to/destination/folder"
-
-# copy_files(files_to_copy, source_folder, destination_folder)
@@ -0,0 +1,158 @@
+"""
+Authentication and request execution for the YouTube API, shared by
+uploader.py and delete_duplicates.py.
+
+The OAuth console flow only runs the first time: the credentials are
+then kept in TOKEN_FILE and refreshed when they expire. Each thread gets
+its own client, built once on its own authorized HTTP connection, which
+is reused for all its requests.
+
+Requests and batches are retried with jittered exponential backoff when
+they fail for a reason worth retrying: server errors and rate limits.
+Everything else, notably quotaExceeded, is returned to the caller as
+before.
+"""
+
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import httplib2
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+# This scope allows for full read/write
+# access to the authenticated user's account
+# and requires requests to use an SSL connection.
+SCOPES = ["https://www.googleapis.com/auth/youtube.force-ssl"]
+API_SERVICE_NAME = "youtube"
+API_VERSION = "v3"
+CLIENT_SECRETS_FILE = "client_secret.json"
+TOKEN_FILE = Path("token.json")
+
+# Up to MAX_RETRIES retries, waiting a random time between 0 and
+# BACKOFF_BASE * 2 ** attempt seconds, capped at BACKOFF_CAP
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 32.0
+RETRY_REASONS = {
+    "backendError",
+    "internalError",
+    "rateLimitExceeded",
+    "userRateLimitExceeded",
+    "serviceUnavailable",
+}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (ConnectionError, TimeoutError, httplib2.HttpLib2Error)
+
+
+def get_credentials():
+    """the cached credentials, refreshed if needed; the console flow from
+    the YouTube API documentation only when there are none
+    """
+    credentials = None
+    if TOKEN_FILE.exists():
+        credentials = Credentials.from_authorized_user_file(str(TOKEN_FILE), SCOPES)
+    if credentials and credentials.valid:
+        return credentials
+    if credentials and credentials.expired and credentials.refresh_token:
+        credentials.refresh(Request())
+    else:
+        flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
+        credentials = flow.run_console()
+    TOKEN_FILE.write_text(credentials.to_json())
+    return credentials
+
+
+def thread_local_clients(credentials):
+    """return a function giving each thread its own client, since they
+    are not thread safe
+    """
+    local = threading.local()
+
+    def get_client():
+        if not hasattr(local, "client"):
+            http = AuthorizedHttp(credentials, http=httplib2.Http())
+            local.client = build(API_SERVICE_NAME, API_VERSION, http=http)
+        return local.client
+
+    return get_client
+
+
+def reason_of(error: HttpError) -> Optional[str]:
+    details = error.error_details
+    if isinstance(details, list) and details and isinstance(details[0], dict):
+        return details[0].get("reason")
+    return None
+
+
+def message_of(error: HttpError) -> str:
+    """the message of the error, even when the response wasn't JSON"""
+    details = error.error_details
+    if isinstance(details, list) and details and isinstance(details[0], dict):
+        return details[0].get("message") or str(error)
+    return str(error)
+
+
+def should_retry(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        reason = reason_of(error)
+        if reason is not None:
+            return reason in RETRY_REASONS
+        return error.resp.status in RETRY_STATUSES
+    return isinstance(error, RETRY_EXCEPTIONS)
+
+
+def backoff(attempt: int):
+    time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt)))
+
+
+def execute(request, max_retries: Optional[int] = None):
+    """execute a request, retrying it if it fails for a transient reason"""
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        try:
+            return request.execute()
+        except Exception as e:
+            if attempt == max_retries or not should_retry(e):
+                raise
+            print(f">>>> Retrying after {e}")
+            backoff(attempt)
+
+
+def execute_batch(client, requests: dict, callback, max_retries: Optional[int] = None):
+    """send request id => request in one batch, and call back with
+    (request id, response, exception) for each, like a batch does. The
+    ones that fail for a transient reason are sent again in a new batch
+    """
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        retry = {}
+
+        def collect(request_id, response, exception):
+            if exception is not None and should_retry(exception):
+                retry[request_id] = requests[request_id]
+                if attempt < max_retries:
+                    return
+            callback(request_id, response, exception)
+
+        batch = client.new_batch_http_request(callback=collect)
+        for request_id, request in requests.items():
+            batch.add(request, request_id=request_id)
+        try:
+            batch.execute()
+        except Exception as e:
+            if attempt == max_retries or not should_retry(e):
+                raise
+            retry = requests
+        if not retry or attempt == max_retries:
+            return
+        print(f">>>> Retrying {len(retry)} requests of a batch")
+        requests = retry
+        backoff(attempt)
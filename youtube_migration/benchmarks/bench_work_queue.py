@@ -0,0 +1,73 @@
+"""Building the work queue of uploader.py from a mostly finished CSV,
+per row lookups versus a filter on Status.
+
+Usage: python benchmarks/bench_work_queue.py [--rows 200000] [--done 0.95]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from uploader import (  # noqa: E402
+    COL_PLAYLIST_ID,
+    COL_STATUS,
+    COL_VIDEO_ID,
+    LABEL_404,
+    LABEL_DONE,
+    pending_queues,
+)
+
+
+def row_by_row_queues(df: pd.DataFrame) -> dict:
+    """how partly_processed_csv used to do it"""
+    queues = {}
+    for row in df.itertuples():
+        data = df.loc[row.Index, [COL_VIDEO_ID, COL_STATUS, COL_PLAYLIST_ID]]
+        video_id, status, playlist_id = data.values
+        if status in [LABEL_DONE, LABEL_404]:
+            continue
+        queues.setdefault(playlist_id, []).append((row.Index, video_id))
+    return queues
+
+
+def measure(label: str, build, df: pd.DataFrame) -> dict:
+    start = time.perf_counter()
+    queues = build(df)
+    elapsed = time.perf_counter() - start
+    pending = sum(len(queue) for queue in queues.values())
+    print(f"{label:<12}{elapsed * 1000:10.1f} ms {pending:8} pending")
+    return queues
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--done", type=float, default=0.95)
+    args = parser.parse_args()
+
+    finished = int(args.rows * args.done)
+    df = pd.DataFrame(
+        {
+            COL_VIDEO_ID: [f"video{index:07}" for index in range(args.rows)],
+            "Time Added": "2022-05-01 16:28:50 UTC",
+            COL_STATUS: [LABEL_DONE] * finished + [""] * (args.rows - finished),
+            COL_PLAYLIST_ID: [f"PL{index % 20:02}" for index in range(args.rows)],
+        }
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = Path(tmp_dir) / "data.csv"
+        df.to_csv(csv_file, index=False)
+        df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+
+    print(f"{args.rows} rows, {args.done:.0%} done")
+    expected = measure("row by row", row_by_row_queues, df)
+    assert measure("filtered", pending_queues, df) == expected
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Loading the rows still to do from a mostly finished working file, CSV
+versus Parquet. Needs pyarrow.
+
+Usage: python benchmarks/bench_working_file.py [--rows 500000] [--done 0.95]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from uploader import (  # noqa: E402
+    COL_PLAYLIST_ID,
+    COL_STATUS,
+    COL_VIDEO_ID,
+    LABEL_DONE,
+    read_working_file,
+    write_working_file,
+)
+
+
+def measure(label: str, path: Path) -> int:
+    start = time.perf_counter()
+    df = read_working_file(path, pending_only=True)
+    elapsed = time.perf_counter() - start
+    size = path.stat().st_size / 1024 / 1024
+    print(f"{label:<10}{elapsed * 1000:10.1f} ms {size:8.1f} MB {len(df):8} pending")
+    return len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--done", type=float, default=0.95)
+    args = parser.parse_args()
+
+    finished = int(args.rows * args.done)
+    df = pd.DataFrame(
+        {
+            COL_VIDEO_ID: [f"video{index:07}" for index in range(args.rows)],
+            "Time Added": "2022-05-01 16:28:50 UTC",
+            COL_STATUS: [LABEL_DONE] * finished + [""] * (args.rows - finished),
+            COL_PLAYLIST_ID: [f"PL{index % 20:02}" for index in range(args.rows)],
+        }
+    )
+    print(f"{args.rows} rows, {args.done:.0%} done")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = Path(tmp_dir) / "data.csv"
+        parquet_file = Path(tmp_dir) / "data.parquet"
+        write_working_file(df, csv_file)
+        write_working_file(df, parquet_file)
+        assert measure("CSV", csv_file) == measure("Parquet", parquet_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,16 @@ Concatanetes the CSV files generated by a YouTube data takeout, and
 formats the resulting file to make it suitable to use for uploader.py.
 Note that all the paths are hard coded in the script
 
+The playlists are read in parallel and written out one after the other
+as they come, so only a few of them are in memory at any time. Videos
+that appear more than once in the same playlist are only written once.
+With --update the new videos are appended to the latest CSV in data/
+instead, leaving the status of the ones already there as it is.
+
+With --parquet the working file is written as Parquet instead, which
+needs pyarrow: Playlist ID is stored as a category, and uploader.py
+only reads the rows still to do.
+
 Usage:
     ❯ python csv-concat.py
     reading PLZ6Ih9wLHQ2H1u5cOpSWgVGsn8YLWMmdy.csv
@@ -13,14 +23,32 @@ Usage:
     reading PLZ6Ih9wLHQ2HDOnRZaKQSWz8R4II0163v.csv
     reading PLZ6Ih9wLHQ2FDvivyW8_xcp6qG4-D45yh.csv
     Created data/20220828T170021_data.csv
+
+    ❯ python csv-concat.py --update
+    ...
+    Added 12 videos to data/20220828T170021_data.csv
+
+    ❯ python csv-concat.py --parquet
+    ...
+    Created data/20220828T170021_data.parquet
 """
 
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 from datetime import datetime
 
 SOURCE_DIR = Path("./playlists")
 TARGET_DIR = Path("./data")
+COL_VIDEO_ID = "Video ID"
+COL_TIME_ADDED = "Time Added"
+COL_STATUS = "Status"
+COL_PLAYLIST_ID = "Playlist ID"
+COLUMNS = [COL_VIDEO_ID, COL_TIME_ADDED, COL_STATUS, COL_PLAYLIST_ID]
+MAX_WORKERS = 4
+SUFFIX_PARQUET = ".parquet"
 
 
 def with_timestamp(stem: str) -> str:
@@ -29,23 +57,161 @@ def with_timestamp(stem: str) -> str:
     return dt_string + "_" + stem
 
 
-def get_csv_files():
-    csvs = []
-    for p in SOURCE_DIR.glob("*.csv"):
-        print(f"reading {p.name}")
-        playlist = Path(p.name).stem
-        df = pd.read_csv(SOURCE_DIR / p.name, skiprows=3)
-        df["Status"] = pd.Series(["" for x in range(len(df.index))])
-        df["Playlist ID"] = pd.Series([playlist for x in range(len(df.index))])
-        csvs.append(df)
-    return pd.concat(csvs)
+def read_playlist(path: Path) -> pd.DataFrame:
+    """one takeout CSV, with the columns uploader.py expects
+
+    Raises:
+        ValueError: if the CSV doesn't have the takeout columns
+    """
+    df = pd.read_csv(path, skiprows=3, dtype=str, keep_default_na=False)
+    df.columns = df.columns.str.strip()
+    missing = {COL_VIDEO_ID, COL_TIME_ADDED}.difference(df.columns)
+    if missing:
+        raise ValueError(f"{path.name} has no {', '.join(sorted(missing))} column")
+    df = df[[COL_VIDEO_ID, COL_TIME_ADDED]].assign(
+        **{COL_STATUS: "", COL_PLAYLIST_ID: path.stem}
+    )
+    return df.drop_duplicates(COL_VIDEO_ID)
+
+
+def read_playlists(paths, max_workers: int = MAX_WORKERS):
+    """read the CSVs in parallel, and yield (path, DataFrame or error)
+    in order, with no more than max_workers of them read ahead
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for path in paths:
+            print(f"reading {path.name}")
+            pending.append((path, executor.submit(read_playlist, path)))
+            if len(pending) >= max_workers:
+                yield result_of(*pending.popleft())
+        while pending:
+            yield result_of(*pending.popleft())
+
+
+def result_of(path: Path, future):
+    try:
+        return (path, future.result())
+    except Exception as exc:
+        return (path, exc)
+
+
+def already_there(target: Path) -> dict:
+    """playlist id => set of the video ids already in target"""
+    if target.suffix == SUFFIX_PARQUET:
+        existing = pd.read_parquet(target, columns=[COL_VIDEO_ID, COL_PLAYLIST_ID])
+        existing = existing.astype(str)
+    else:
+        existing = pd.read_csv(
+            target,
+            usecols=[COL_VIDEO_ID, COL_PLAYLIST_ID],
+            dtype=str,
+            keep_default_na=False,
+        )
+    return {
+        playlist_id: set(df[COL_VIDEO_ID])
+        for playlist_id, df in existing.groupby(COL_PLAYLIST_ID)
+    }
+
+
+def concat_csv_files(target: Path, update: bool = False) -> int:
+    """write the playlists into target, or append the videos not yet in
+    it with update. Return how many videos were written
+    """
+    seen = already_there(target) if update else {}
+    columns = list(pd.read_csv(target, nrows=0).columns) if update else COLUMNS
+    written = 0
+    with open(target, "a" if update else "w", newline="") as file:
+        header = not update
+        for df in new_videos(seen):
+            df.reindex(columns=columns, fill_value="").to_csv(
+                file, index=False, header=header
+            )
+            header = False
+            written += len(df)
+    return written
+
+
+def new_videos(seen: dict):
+    """the videos of each playlist not seen before, in order"""
+    for path, df in read_playlists(sorted(SOURCE_DIR.glob("*.csv"))):
+        if isinstance(df, Exception):
+            print(f">>>> Skipping {path.name}: {df}")
+            continue
+        videos = seen.setdefault(path.stem, set())
+        df = df[~df[COL_VIDEO_ID].isin(videos)]
+        videos.update(df[COL_VIDEO_ID])
+        yield df
+
+
+def concat_parquet_files(target: Path, update: bool = False) -> int:
+    """same as concat_csv_files, into a Parquet file. Each playlist is
+    written as a row group; with update the file is written again, with
+    the new videos at the end
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print(">>>> Parquet needs pyarrow: pip install pyarrow")
+        raise
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema(
+        [
+            (COL_VIDEO_ID, pa.string()),
+            (COL_TIME_ADDED, pa.string()),
+            (COL_STATUS, pa.string()),
+            (COL_PLAYLIST_ID, category),
+        ]
+    )
+    existing = pq.read_table(target) if update else None
+    seen = already_there(target) if update else {}
+    written = 0
+    tmp_file = target.with_suffix(".tmp")
+    with pq.ParquetWriter(tmp_file, schema) as writer:
+        if existing is not None:
+            writer.write_table(existing.select(schema.names).cast(schema))
+        for df in new_videos(seen):
+            writer.write_table(
+                pa.Table.from_pandas(df[COLUMNS], schema=schema, preserve_index=False)
+            )
+            written += len(df)
+    tmp_file.replace(target)
+    return written
 
 
 def main():
-    concatenated_df = get_csv_files()
-    destination_csv = TARGET_DIR / with_timestamp("data.csv")
-    concatenated_df.to_csv(destination_csv, index=False)
-    print(f"Created {destination_csv}")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="append new videos to the latest CSV in data/ instead of creating one",
+    )
+    parser.add_argument(
+        "--parquet",
+        action="store_true",
+        help="write or update a Parquet working file instead of a CSV",
+    )
+    args = parser.parse_args()
+    concat = concat_parquet_files if args.parquet else concat_csv_files
+
+    if args.update:
+        suffix = SUFFIX_PARQUET if args.parquet else ".csv"
+        targets = sorted(TARGET_DIR.glob(f"*{suffix}"))
+        if not targets:
+            parser.error(
+                f"no {suffix} file in {TARGET_DIR} to update, run without --update"
+            )
+        target = targets[-1]
+        written = concat(target, update=True)
+        print(f"Added {written} videos to {target}")
+    else:
+        target = TARGET_DIR / with_timestamp("data.csv")
+        if args.parquet:
+            target = target.with_suffix(SUFFIX_PARQUET)
+        concat(target)
+        print(f"Created {target}")
 
 
 if __name__ == "__main__":
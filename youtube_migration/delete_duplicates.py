@@ -2,120 +2,286 @@
 DISCLAIMER: this is provided for educataional purposes only. Use at your
 own risk
 
-Removes duplicate videos from youtube playlists
+Removes duplicate videos from youtube playlists. By default only
+duplicates within the same playlist are removed; with --across a video
+is only kept once in all the playlists passed. Which copy is kept
+depends on --keep: the first one listed, or the one added to its
+playlist first (oldest) or last (newest).
+
+Before deleting anything, playlists are always listed again with the
+API, since deletes can't be undone. The pages of the local snapshot
+shared with uploader.py are sent along as ETags, so pages that didn't
+change come back empty and only cost the list. --dry-run reports what
+would be deleted from the snapshot alone, without calling the API.
 
 Usage:
     > python delete_duplicates.py playlistid_1 playlistid_2 ... playlistid_n
+    > python delete_duplicates.py --across --keep oldest --dry-run playlistid_1 ...
 """
 
-import sys
+import argparse
 import os
-from googleapiclient.discovery import build
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 from googleapiclient.errors import HttpError
-from google_auth_oauthlib.flow import InstalledAppFlow
-
-MAX_RESULTS = 50
-LABEL_QUOTA_EXCEEDED = "quotaExceeded"
 
-# This scope allows for full read/write
-# access to the authenticated user's account
-# and requires requests to use an SSL connection.
-SCOPES = ["https://www.googleapis.com/auth/youtube.force-ssl"]
-API_SERVICE_NAME = "youtube"
-API_VERSION = "v3"
-CLIENT_SECRETS_FILE = "client_secret.json"
+from api import (
+    execute_batch,
+    get_credentials,
+    message_of,
+    reason_of,
+    thread_local_clients,
+)
+from quota import COST_DELETE, QuotaLedger
+from snapshot import PlaylistStore
 
+# deletes are sent this many at a time in a single HTTP request
+BATCH_SIZE = 50
+LABEL_QUOTA_EXCEEDED = "quotaExceeded"
+KEEP_FIRST = "first"
+KEEP_OLDEST = "oldest"
+KEEP_NEWEST = "newest"
 
-if len(sys.argv) == 1:
-    print("You need to pass a space serataed list of playlist IDs as argument")
-    exit()
+# Playlists are listed in parallel, each by one worker, a page after the
+# other. Deletes run in their own worker, for each playlist as soon as it
+# is listed in full, so that paging isn't thrown off by items disappearing
+MAX_WORKERS = 4
 
 
-def get_authenticated_service():
-    """straight from the YouTube API documentation"""
-    flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
-    credentials = flow.run_console()
-    return build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
+def delete_videos_and_maybe_stop(client, playlist_item_ids, ledger):
+    """delete a batch of playlist items with a single HTTP request. Return
+    a tuple: true if it should stop, false otherwise; and the ids of the
+    ones deleted
+    """
+    should_stop = False
+    exceeded = False
+    deleted = set()
 
+    def callback(request_id, response, exception):
+        nonlocal exceeded
+        if exception is None:
+            deleted.add(request_id)
+        elif not isinstance(exception, HttpError):
+            print(f">>>> ERROR deleting {request_id} {exception}")
+        elif reason_of(exception) == LABEL_QUOTA_EXCEEDED:
+            exceeded = True
+        else:
+            print(f">>>> ERROR {message_of(exception)}")
 
-def delete_video_and_maybe_stop(client, playlist_item_id) -> bool:
-    """return true if it should stop, false otherwise"""
-    try:
+    requests = {}
+    for playlist_item_id in playlist_item_ids:
+        if not ledger.charge(COST_DELETE):
+            print(">>>> No quota left - that was it for today, tray again tomorrow!")
+            should_stop = True
+            break
         print(f"-> Deleting {playlist_item_id}")
-        (client.playlistItems().delete(id=playlist_item_id)).execute()
-        return False
+        requests[playlist_item_id] = client.playlistItems().delete(id=playlist_item_id)
+    try:
+        execute_batch(client, requests, callback)
     except HttpError as e:
-        if e.error_details[0]["reason"] == LABEL_QUOTA_EXCEEDED:  # type: ignore
-            print(f">>>> Quota exceeded - that was it for today, tray again tomorrow!")
-            return True
-        else:
-            print(f">>>> ERROR {e.error_details[0]['message']}")
-            return False
+        if reason_of(e) != LABEL_QUOTA_EXCEEDED:
+            print(f">>>> ERROR {message_of(e)}")
+            return (should_stop, deleted)
+        exceeded = True
+    if exceeded:
+        print(">>>> Quota exceeded - that was it for today, tray again tomorrow!")
+        ledger.exhausted()
+    return (should_stop or exceeded, deleted)
+
+
+class DuplicateIndex:
+    """the copy of each video to keep, by video id or by (playlist id,
+    video id), and the ones to delete. Items can be added in any order
+    """
+
+    def __init__(self, keep: str = KEEP_FIRST, across: bool = False):
+        self.keep = keep
+        self.across = across
+        self.keepers = {}
+        self.duplicates = []
+
+    def _wins(self, item, keeper) -> bool:
+        """whether item should be kept instead of keeper"""
+        if self.keep != KEEP_FIRST and item["added"] != keeper["added"]:
+            return (item["added"] < keeper["added"]) == (self.keep == KEEP_OLDEST)
+        return item["order"] < keeper["order"]
+
+    def add(self, item):
+        """return the item that turned out to be a duplicate, if any. Once
+        a duplicate, always a duplicate: keepers are only ever replaced
+        by copies that win over them
+        """
+        key = (
+            item["video_id"] if self.across else (item["playlist_id"], item["video_id"])
+        )
+        keeper = self.keepers.get(key)
+        if keeper is None:
+            self.keepers[key] = item
+            return None
+        if self._wins(item, keeper):
+            self.keepers[key], item = item, keeper
+        self.duplicates.append(item)
+        print(f"found a duplicate: {item['title']} in {item['playlist_id']}")
+        return item
+
+    def to_delete(self):
+        """playlist id => ids of the playlist items to delete"""
+        to_delete = {}
+        for item in sorted(self.duplicates, key=lambda item: item["order"]):
+            to_delete.setdefault(item["playlist_id"], []).append(item["id"])
+        return to_delete
 
 
-def get_vides_to_delete_for_playlist_and_maybe_stop(client, playlist_id):
-    """return a tuple: true if it should stop, false otherwise; and a list of video ids"""
-    videos_already_done = []
-    videos_to_delete = []
-    page_token = ""
+def as_item(playlist_rank: int, item):
+    """a snapshot item, placed in the order the playlists were passed"""
+    return {**item, "id": item["item_id"], "order": (playlist_rank, item["position"])}
+
+
+def report(playlist_ids, keep: str = KEEP_FIRST, across: bool = False):
+    """what would be deleted, going by the local snapshot only"""
+    store = PlaylistStore()
+    index = DuplicateIndex(keep, across)
+    for rank, playlist_id in enumerate(playlist_ids):
+        if store.refreshed_at(playlist_id) is None:
+            print(f">>>> {playlist_id} is not in {store.path}, run without --dry-run")
+            continue
+        for item in store.items(playlist_id):
+            index.add(as_item(rank, item))
+    to_delete = index.to_delete()
+    if not to_delete:
+        print("no duplicates found")
+    for playlist_id, item_ids in to_delete.items():
+        print(f"would delete {len(item_ids)} videos for playlist {playlist_id}")
+
+
+def delete_from_queue(get_client, queue, ledger, store, deleted):
+    """delete the items put in the queue, a batch at a time, until None
+    comes. Once out of quota, the rest are only taken off the queue
+    """
+    client = get_client()
     should_stop = False
-    try:
-        while True:
-            response = (
-                client.playlistItems()
-                .list(
-                    part="snippet,contentDetails",
-                    playlistId=playlist_id,
-                    pageToken=page_token,
-                    maxResults=MAX_RESULTS,
-                )
-                .execute()
-            )
-            print(f"page_token: {page_token}, playlistId: {playlist_id}")
-            # print(json.dumps(response, indent=2))
-            for item in response["items"]:
+    finished = False
+    while not finished:
+        items = [queue.get()]
+        while len(items) < BATCH_SIZE and not queue.empty():
+            items.append(queue.get())
+        finished = None in items
+        items = [item for item in items if item is not None]
+        if should_stop or not items:
+            continue
+        should_stop, batch_deleted = delete_videos_and_maybe_stop(
+            client, [item["id"] for item in items], ledger
+        )
+        store.remove_items(batch_deleted)
+        deleted |= batch_deleted
+
+
+def main(
+    get_client,
+    playlist_ids,
+    keep: str = KEEP_FIRST,
+    across: bool = False,
+    ledger=None,
+    max_workers: int = MAX_WORKERS,
+    store=None,
+):
+    """list the playlists in parallel, finding duplicates as pages come
+    in, and delete them as soon as their playlist is listed. Playlists
+    are always listed, never only read from the snapshot, which could be
+    out of date: deleting a duplicate whose other copy is gone would
+    delete the last one
+    """
+    ledger = QuotaLedger() if ledger is None else ledger
+    store = PlaylistStore() if store is None else store
+    index = DuplicateIndex(keep, across)
+    lock = threading.Lock()
+    stop = threading.Event()
+    listing = {playlist_id: [] for playlist_id in playlist_ids}
+    found = {}
+    deleted = set()
+    to_delete = Queue()
 
-                if item["contentDetails"]["videoId"] in videos_already_done:
-                    videos_to_delete.append(item["id"])
-                    print(f"found a duplicate: {item['snippet']['title']}")
+    def on_page(rank, items):
+        with lock:
+            for item in items:
+                duplicate = index.add(as_item(rank, item))
+                if duplicate is None:
+                    continue
+                found.setdefault(duplicate["playlist_id"], []).append(duplicate)
+                if duplicate["playlist_id"] in listing:
+                    listing[duplicate["playlist_id"]].append(duplicate)
                 else:
-                    videos_already_done.append(item["contentDetails"]["videoId"])
-            if not "nextPageToken" in response:
-                print("that was the last page")
-                break
-            page_token = response["nextPageToken"]
-    except HttpError as e:
-        if e.error_details[0]["reason"] == LABEL_QUOTA_EXCEEDED:  # type: ignore
-            print(f">>>> Quota exceeded that was it for today, tray again tomorrow!")
-            should_stop = True
-        else:
-            print(f">>>> ERROR {e.error_details[0]['message']}")
-    return (should_stop, videos_to_delete)
+                    to_delete.put(duplicate)
 
+    def list_playlist(rank, playlist_id):
+        if not stop.is_set():
+            should_stop, _ = store.refresh(
+                get_client(), playlist_id, ledger, lambda page: on_page(rank, page)
+            )
+            if should_stop:
+                stop.set()
+        with lock:
+            for duplicate in listing.pop(playlist_id):
+                to_delete.put(duplicate)
 
-def main(client):
-    for playlist_id in sys.argv[1:]:
-        should_stop, videos_to_delete = get_vides_to_delete_for_playlist_and_maybe_stop(
-            client, playlist_id
-        )
-        if should_stop:
-            break
-        deleted = 0
-        for playlist_item_id in videos_to_delete:
-            should_break = delete_video_and_maybe_stop(client, playlist_item_id)
-            if should_break:
-                break
-            deleted += 1
+    deleter = threading.Thread(
+        target=delete_from_queue, args=(get_client, to_delete, ledger, store, deleted)
+    )
+    deleter.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(list_playlist, rank, playlist_id)
+                for rank, playlist_id in enumerate(playlist_ids)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        to_delete.put(None)
+        deleter.join()
+        # what was spent is spent, even if a worker failed
+        ledger.save()
+
+    for playlist_id, duplicates in found.items():
+        done = sum(1 for item in duplicates if item["id"] in deleted)
         print(
-            f"deleted {deleted} videos out of {len(videos_to_delete)} for playlist {playlist_id}"
+            f"deleted {done} videos out of {len(duplicates)} for playlist {playlist_id}"
         )
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("playlist_ids", nargs="+", metavar="playlist_id")
+    parser.add_argument(
+        "--across",
+        action="store_true",
+        help="keep each video only once in all the playlists, not once per playlist",
+    )
+    parser.add_argument(
+        "--keep",
+        choices=[KEEP_FIRST, KEEP_OLDEST, KEEP_NEWEST],
+        default=KEEP_FIRST,
+        help="which copy to keep: first listed, or added first or last",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report what would be deleted from the local snapshot, without the API",
+    )
+    args = parser.parse_args()
+    if args.dry_run:
+        report(args.playlist_ids, args.keep, args.across)
+        exit()
+
     # When running locally, disable OAuthlib's
     # HTTPs verification. When running in production
     # * do not * leave this option enabled.
     os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
-    client = get_authenticated_service()
-    main(client)
+    main(
+        thread_local_clients(get_credentials()),
+        args.playlist_ids,
+        args.keep,
+        args.across,
+    )
     print("DONE")
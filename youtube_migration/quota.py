@@ -0,0 +1,80 @@
+"""
+Keeps track of the YouTube API quota spent today, shared by uploader.py
+and delete_duplicates.py.
+
+Every call costs a known number of units out of a daily budget, which
+resets at midnight Pacific time. The units spent are written to a local
+ledger, so that each run knows up front how much is left and only
+attempts the calls that fit, instead of finding out with a
+quotaExceeded error.
+"""
+
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+LEDGER_FILE = Path("./data/quota.json")
+DAILY_QUOTA = 10_000
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+# https://developers.google.com/youtube/v3/determine_quota_cost
+COST_LIST = "list"
+COST_INSERT = "insert"
+COST_DELETE = "delete"
+COSTS = {COST_LIST: 1, COST_INSERT: 50, COST_DELETE: 50}
+
+
+def quota_day() -> str:
+    """the day the quota is counted against"""
+    return datetime.now(QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+
+class QuotaLedger:
+    """units spent today, thread safe. Calls are charged before they are
+    made: a failed call is still charged by YouTube
+    """
+
+    def __init__(self, path: Path = LEDGER_FILE, daily_quota: int = DAILY_QUOTA):
+        self.path = path
+        self.daily_quota = daily_quota
+        self.day = quota_day()
+        self.spent = 0
+        self.lock = threading.Lock()
+        if path.exists():
+            ledger = json.loads(path.read_text())
+            if ledger["day"] == self.day:
+                self.spent = ledger["spent"]
+
+    @property
+    def remaining(self) -> int:
+        return max(self.daily_quota - self.spent, 0)
+
+    def affordable(self, call: str, reserve: int = 0) -> int:
+        """how many calls of this type fit in what is left, keeping
+        reserve units aside for other calls
+        """
+        return max(self.remaining - reserve, 0) // COSTS[call]
+
+    def charge(self, call: str) -> bool:
+        """book the cost of a call about to be made; return false, booking
+        nothing, if it doesn't fit in what is left
+        """
+        with self.lock:
+            if self.spent + COSTS[call] > self.daily_quota:
+                return False
+            self.spent += COSTS[call]
+            return True
+
+    def exhausted(self):
+        """YouTube said quotaExceeded, whatever the ledger thought"""
+        with self.lock:
+            self.spent = self.daily_quota
+
+    def save(self):
+        with self.lock:
+            ledger = {"day": self.day, "spent": self.spent}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(ledger))
+        print(f"quota: {self.spent} of {self.daily_quota} units spent on {self.day}")
@@ -0,0 +1,263 @@
+"""
+Local snapshot of playlists and their items in SQLite, shared by
+uploader.py and delete_duplicates.py.
+
+Both scripts read playlists from here, and only list them with the API
+when their snapshot is older than SNAPSHOT_TTL. Even then each page is
+requested with the etag it had last time, and pages that didn't change
+come back as 304 Not Modified and are taken from the snapshot. Inserts
+and deletes are written through to the snapshot as they happen, so that
+it stays current between refreshes.
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from googleapiclient.errors import HttpError
+
+from api import execute, message_of, reason_of
+from quota import COST_LIST, QuotaLedger
+
+SNAPSHOT_FILE = Path("./data/playlists.sqlite")
+SNAPSHOT_TTL = 24 * 60 * 60
+MAX_RESULTS = 50
+LABEL_QUOTA_EXCEEDED = "quotaExceeded"
+LIST_FIELDS = (
+    "etag,nextPageToken,"
+    "items(id,etag,contentDetails/videoId,snippet(title,position,publishedAt))"
+)
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist_id TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    playlist_id TEXT NOT NULL,
+    page_token TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    next_page_token TEXT,
+    PRIMARY KEY (playlist_id, page_token)
+);
+CREATE TABLE IF NOT EXISTS items (
+    item_id TEXT PRIMARY KEY,
+    playlist_id TEXT NOT NULL,
+    page_token TEXT,
+    position INTEGER,
+    video_id TEXT NOT NULL,
+    etag TEXT,
+    title TEXT,
+    added TEXT
+);
+CREATE INDEX IF NOT EXISTS items_playlist ON items (playlist_id, position);
+"""
+
+ITEM_COLUMNS = [
+    "item_id",
+    "playlist_id",
+    "page_token",
+    "position",
+    "video_id",
+    "etag",
+    "title",
+    "added",
+]
+
+
+def as_row(playlist_id: str, page_token: str, item) -> tuple:
+    """an item as returned by the API, as a row of the items table"""
+    return (
+        item["id"],
+        playlist_id,
+        page_token,
+        item["snippet"].get("position"),
+        item["contentDetails"]["videoId"],
+        item.get("etag"),
+        item["snippet"].get("title"),
+        item["snippet"].get("publishedAt"),
+    )
+
+
+class PlaylistStore:
+    """versioned on-disk snapshot of playlists, thread safe"""
+
+    def __init__(self, path: Path = SNAPSHOT_FILE, ttl: int = SNAPSHOT_TTL):
+        self.path = path
+        self.ttl = ttl
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self._migrate()
+
+    def _migrate(self):
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version > SCHEMA_VERSION:
+            raise ValueError(
+                f"{self.path} has version {version}, "
+                f"this code only knows up to {SCHEMA_VERSION}"
+            )
+        if version < SCHEMA_VERSION:
+            with self.connection:
+                self.connection.executescript(SCHEMA)
+                self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def refreshed_at(self, playlist_id: str) -> Optional[float]:
+        """when the playlist was last listed in full, if ever"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT refreshed_at FROM playlists WHERE playlist_id = ?",
+                (playlist_id,),
+            ).fetchone()
+        return None if row is None else row["refreshed_at"]
+
+    def is_fresh(self, playlist_id: str) -> bool:
+        refreshed_at = self.refreshed_at(playlist_id)
+        return refreshed_at is not None and time.time() - refreshed_at < self.ttl
+
+    def items(self, playlist_id: str) -> list[dict]:
+        """the items of a playlist, in order"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM items WHERE playlist_id = ? ORDER BY position",
+                (playlist_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def video_ids(self, playlist_id: str) -> set[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT video_id FROM items WHERE playlist_id = ?", (playlist_id,)
+            )
+            return {video_id for (video_id,) in rows}
+
+    def _page(self, playlist_id: str, page_token: str):
+        with self.lock:
+            page = self.connection.execute(
+                "SELECT etag, next_page_token FROM pages "
+                "WHERE playlist_id = ? AND page_token = ?",
+                (playlist_id, page_token),
+            ).fetchone()
+            if page is None:
+                return None, []
+            rows = self.connection.execute(
+                "SELECT * FROM items "
+                "WHERE playlist_id = ? AND page_token = ? ORDER BY position",
+                (playlist_id, page_token),
+            ).fetchall()
+        return page, rows
+
+    def refresh(self, client, playlist_id: str, ledger: QuotaLedger, on_page=None):
+        """list a playlist again, a page after the other, passing the items
+        of each page to on_page as they come. Return a tuple: true if it
+        should stop, false otherwise; and the items, or None if it
+        couldn't list them all
+        """
+        pages = []
+        rows = []
+        page_token = ""
+        try:
+            while True:
+                if not ledger.charge(COST_LIST):
+                    print(f">>>> No quota left to list {playlist_id}")
+                    return (True, None)
+                page, stored_rows = self._page(playlist_id, page_token)
+                request = client.playlistItems().list(
+                    part="snippet,contentDetails",
+                    playlistId=playlist_id,
+                    pageToken=page_token,
+                    maxResults=MAX_RESULTS,
+                    fields=LIST_FIELDS,
+                )
+                if page is not None:
+                    request.headers["If-None-Match"] = page["etag"]
+                try:
+                    response = execute(request)
+                except HttpError as e:
+                    if page is None or e.resp.status != 304:
+                        raise
+                    page_rows = [tuple(row) for row in stored_rows]
+                    etag, next_page_token = page["etag"], page["next_page_token"]
+                else:
+                    page_rows = [
+                        as_row(playlist_id, page_token, item)
+                        for item in response["items"]
+                    ]
+                    etag = response["etag"]
+                    next_page_token = response.get("nextPageToken")
+                pages.append((playlist_id, page_token, etag, next_page_token))
+                rows.extend(page_rows)
+                if on_page is not None:
+                    on_page([dict(zip(ITEM_COLUMNS, row)) for row in page_rows])
+                if not next_page_token:
+                    break
+                page_token = next_page_token
+        except HttpError as e:
+            if reason_of(e) == LABEL_QUOTA_EXCEEDED:
+                print(f">>>> Quota exceeded when listing {playlist_id}")
+                ledger.exhausted()
+                return (True, None)
+            print(f">>>> ERROR LISTING {playlist_id} {message_of(e)}")
+            return (False, None)
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM items WHERE playlist_id = ?", (playlist_id,)
+            )
+            self.connection.execute(
+                "DELETE FROM pages WHERE playlist_id = ?", (playlist_id,)
+            )
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO items ({', '.join(ITEM_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(ITEM_COLUMNS))})",
+                rows,
+            )
+            self.connection.executemany(
+                "INSERT INTO pages (playlist_id, page_token, etag, next_page_token) "
+                "VALUES (?, ?, ?, ?)",
+                pages,
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO playlists (playlist_id, refreshed_at) "
+                "VALUES (?, ?)",
+                (playlist_id, time.time()),
+            )
+        print(f"-> {playlist_id} has {len(rows)} videos")
+        return (False, [dict(zip(ITEM_COLUMNS, row)) for row in rows])
+
+    def add_item(self, playlist_id: str, item):
+        """an item just inserted with the API. Pages are shifted from then
+        on, so the next refresh lists them all again
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO items ({', '.join(ITEM_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(ITEM_COLUMNS))})",
+                as_row(playlist_id, None, item),
+            )
+            self.connection.execute(
+                "DELETE FROM pages WHERE playlist_id = ?", (playlist_id,)
+            )
+
+    def remove_items(self, item_ids):
+        """items just deleted with the API"""
+        item_ids = list(item_ids)
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM pages WHERE playlist_id IN "
+                "(SELECT playlist_id FROM items WHERE item_id = ?)",
+                ((item_id,) for item_id in item_ids),
+            )
+            self.connection.executemany(
+                "DELETE FROM items WHERE item_id = ?",
+                ((item_id,) for item_id in item_ids),
+            )
@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the scripts import each other as top level modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import api  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fixture_workdir(tmp_path, monkeypatch):
+    """Run in an empty directory, since the scripts work in ./data, and
+    retry without waiting
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(api, "BACKOFF_BASE", 0)
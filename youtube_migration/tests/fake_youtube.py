@@ -0,0 +1,141 @@
+"""A fake YouTube API client, with just enough playlistItems() to run
+the scripts against, and a quota that runs out like the real one.
+"""
+
+import json
+import threading
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+COSTS = {"list": 1, "insert": 50, "delete": 50}
+
+
+def http_error(status: int, reason: str) -> HttpError:
+    content = {
+        "error": {
+            "code": status,
+            "message": reason,
+            "errors": [{"reason": reason, "message": reason}],
+        }
+    }
+    return HttpError(
+        httplib2.Response({"status": status}), json.dumps(content).encode()
+    )
+
+
+class FakeRequest:
+    def __init__(self, run):
+        self.run = run
+        self.headers = {}
+
+    def execute(self):
+        return self.run(self)
+
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.requests:
+            try:
+                response, exception = request.execute(), None
+            except HttpError as e:
+                response, exception = None, e
+            self.callback(request_id, response, exception)
+
+
+class FakeYouTube:
+    """playlist id => items, shared by all the clients. Inserting a video
+    id in failures raises the error given for it, once
+    """
+
+    def __init__(self, quota: int = 10_000, playlists=None, page_size: int = 5):
+        self.quota = quota
+        self.playlists = {pl: list(items) for pl, items in (playlists or {}).items()}
+        self.page_size = page_size
+        self.failures = {}
+        self.calls = []
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def client(self):
+        return self
+
+    def spend(self, call: str):
+        with self.lock:
+            self.calls.append(call)
+            if self.quota < COSTS[call]:
+                raise http_error(403, "quotaExceeded")
+            self.quota -= COSTS[call]
+
+    def video_ids(self, playlist_id: str) -> list:
+        return [
+            item["contentDetails"]["videoId"] for item in self.playlists[playlist_id]
+        ]
+
+    def item(self, playlist_id: str, video_id: str) -> dict:
+        with self.lock:
+            self.next_id += 1
+            items = self.playlists.setdefault(playlist_id, [])
+            item = {
+                "id": f"item{self.next_id}",
+                "etag": f"etag{self.next_id}",
+                "contentDetails": {"videoId": video_id},
+                "snippet": {
+                    "title": video_id,
+                    "position": len(items),
+                    "playlistId": playlist_id,
+                    "publishedAt": f"2022-01-01T00:00:{self.next_id:02}Z",
+                },
+            }
+            items.append(item)
+        return item
+
+    def playlistItems(self):
+        return self
+
+    def new_batch_http_request(self, callback):
+        with self.lock:
+            self.calls.append("batch")
+        return FakeBatch(callback)
+
+    def list(self, playlistId, pageToken="", maxResults=5, **kwargs):
+        def run(request):
+            self.spend("list")
+            start = int(pageToken or 0)
+            page = self.playlists.get(playlistId, [])[start : start + self.page_size]
+            etag = str(hash(json.dumps(page, sort_keys=True)))
+            if request.headers.get("If-None-Match") == etag:
+                raise HttpError(httplib2.Response({"status": 304}), b"")
+            response = {"items": page, "etag": etag}
+            if start + self.page_size < len(self.playlists.get(playlistId, [])):
+                response["nextPageToken"] = str(start + self.page_size)
+            return response
+
+        return FakeRequest(run)
+
+    def insert(self, part, body):
+        def run(request):
+            self.spend("insert")
+            video_id = body["snippet"]["resourceId"]["videoId"]
+            if video_id in self.failures:
+                raise self.failures.pop(video_id)
+            return self.item(body["snippet"]["playlistId"], video_id)
+
+        return FakeRequest(run)
+
+    def delete(self, id):
+        def run(request):
+            self.spend("delete")
+            with self.lock:
+                for playlist_id, items in self.playlists.items():
+                    self.playlists[playlist_id] = [i for i in items if i["id"] != id]
+            return ""
+
+        return FakeRequest(run)
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+import delete_duplicates
+from fake_youtube import FakeYouTube
+from quota import LEDGER_FILE, QuotaLedger
+
+
+def test_deletes_duplicates():
+    """Only the first copy of each video is kept in each playlist"""
+    youtube = FakeYouTube()
+    for video_id in ["v1", "v2", "v1", "v3", "v2", "v1"]:
+        youtube.item("PLA", video_id)
+    youtube.item("PLB", "v1")
+
+    delete_duplicates.main(youtube.client, ["PLA", "PLB"])
+
+    assert youtube.video_ids("PLA") == ["v1", "v2", "v3"]
+    assert youtube.video_ids("PLB") == ["v1"]
+
+
+def test_stops_deleting_when_the_quota_runs_out():
+    """Deletes that don't fit in the ledger are not sent"""
+    youtube = FakeYouTube()
+    for video_id in ["v1", "v1", "v1", "v1"]:
+        youtube.item("PLA", video_id)
+
+    delete_duplicates.main(
+        youtube.client, ["PLA"], ledger=QuotaLedger(daily_quota=1 + 50)
+    )
+
+    assert youtube.video_ids("PLA") == ["v1", "v1", "v1"]
+
+
+def test_saves_the_quota_spent_when_a_worker_fails():
+    """The next run knows about the units spent before the failure"""
+
+    class FailingStore:
+        def refresh(self, client, playlist_id, ledger, on_page=None):
+            ledger.charge("list")
+            raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError):
+        delete_duplicates.main(FakeYouTube().client, ["PLA"], store=FailingStore())
+
+    assert json.loads(LEDGER_FILE.read_text())["spent"] == 1
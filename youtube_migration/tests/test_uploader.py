@@ -0,0 +1,151 @@
+import pandas as pd
+
+import uploader
+from fake_youtube import FakeYouTube, http_error
+from quota import LEDGER_FILE, QuotaLedger
+from uploader import (
+    COL_PLAYLIST_ID,
+    COL_STATUS,
+    COL_VIDEO_ID,
+    LABEL_BLANK,
+    LABEL_DONE,
+    add_videos_to_playlist,
+    partly_processed_csv,
+)
+
+
+def working_df(*rows, status=""):
+    return pd.DataFrame(
+        [
+            {
+                COL_VIDEO_ID: video_id,
+                "Time Added": "2022-05-01 16:28:50 UTC",
+                COL_STATUS: status,
+                COL_PLAYLIST_ID: playlist_id,
+            }
+            for video_id, playlist_id in rows
+        ]
+    )
+
+
+def test_inserts_in_order():
+    """Each playlist gets its videos in CSV order, all marked done"""
+    youtube = FakeYouTube()
+    df = working_df(("v1", "PLA"), ("v2", "PLB"), ("v3", "PLA"), ("v4", "PLA"))
+
+    processed_df = partly_processed_csv(youtube.client, df)
+
+    assert list(processed_df[COL_STATUS]) == [LABEL_DONE] * 4
+    assert youtube.video_ids("PLA") == ["v1", "v3", "v4"]
+    assert youtube.video_ids("PLB") == ["v2"]
+
+
+def test_batch_size():
+    """Inserts are sent batch_size to an HTTP request"""
+    youtube = FakeYouTube()
+    df = working_df(*((f"v{i}", "PLA") for i in range(5)))
+
+    processed_df = partly_processed_csv(youtube.client, df, batch_size=50)
+
+    assert list(processed_df[COL_STATUS]) == [LABEL_DONE] * 5
+    assert youtube.calls.count("batch") == 1
+    assert sorted(youtube.video_ids("PLA")) == [f"v{i}" for i in range(5)]
+
+
+def test_videos_already_there_are_not_inserted():
+    """Videos found when listing the playlist are done without an insert"""
+    youtube = FakeYouTube()
+    youtube.item("PLA", "v1")
+    df = working_df(("v1", "PLA"), ("v2", "PLA"))
+
+    processed_df = partly_processed_csv(youtube.client, df)
+
+    assert list(processed_df[COL_STATUS]) == [LABEL_DONE, LABEL_DONE]
+    assert youtube.calls.count("insert") == 1
+
+
+def test_stops_when_the_quota_runs_out():
+    """Once YouTube says quotaExceeded, the rest is left for another day"""
+    youtube = FakeYouTube(quota=1 + 50 * 2)
+    df = working_df(*((f"v{i}", "PLA") for i in range(5)))
+
+    processed_df = partly_processed_csv(youtube.client, df)
+
+    assert list(processed_df[COL_STATUS]) == [LABEL_DONE] * 2 + [LABEL_BLANK] * 3
+    assert youtube.video_ids("PLA") == ["v0", "v1"]
+
+
+def test_plans_within_the_local_quota():
+    """The ledger defers what doesn't fit today, without calling YouTube"""
+    youtube = FakeYouTube()
+    ledger = QuotaLedger(daily_quota=1 + 50 * 2)
+    df = working_df(*((f"v{i}", "PLA") for i in range(5)))
+
+    processed_df = partly_processed_csv(youtube.client, df, ledger=ledger)
+
+    assert list(processed_df[COL_STATUS]) == [LABEL_DONE] * 2 + [LABEL_BLANK] * 3
+    assert youtube.calls.count("insert") == 2
+
+
+def test_resumes_from_the_journal():
+    """A second run picks up where the first ran out of quota"""
+    youtube = FakeYouTube(quota=1 + 50 * 2)
+    uploader.DATA_DIR.mkdir()
+    working_df(*((f"v{i}", "PLA") for i in range(5))).to_csv(
+        uploader.DATA_DIR / "20220101T000000_data.csv", index=False
+    )
+
+    uploader.main(youtube.client)
+    # the next day
+    youtube.quota = 10_000
+    LEDGER_FILE.unlink()
+    uploader.main(youtube.client)
+
+    assert youtube.video_ids("PLA") == [f"v{i}" for i in range(5)]
+    compacted = uploader.compact(uploader.pick_latest_file(uploader.DATA_DIR))
+    statuses = uploader.read_working_file(compacted)[COL_STATUS]
+    assert list(statuses) == [LABEL_DONE] * 5
+
+
+def test_batch_callbacks():
+    """Each video of a batch gets its own status; transient errors are
+    retried, and left blank if they keep failing
+    """
+    youtube = FakeYouTube()
+    youtube.failures = {
+        "gone": http_error(404, "videoNotFound"),
+        "flaky": http_error(500, "backendError"),
+    }
+    videos = [(0, "v0"), (1, "gone"), (2, "flaky"), (3, "v3")]
+
+    should_stop, statuses, inserted = add_videos_to_playlist(
+        youtube.client(), videos, "PLA"
+    )
+
+    assert not should_stop
+    assert statuses == {0: LABEL_DONE, 1: "videoNotFound", 2: LABEL_DONE, 3: LABEL_DONE}
+    assert set(inserted) == {0, 2, 3}
+
+
+def test_batch_stops_on_quota_exceeded():
+    """quotaExceeded in a batch stops, leaving the video blank"""
+    youtube = FakeYouTube(quota=50)
+    videos = [(0, "v0"), (1, "v1")]
+
+    should_stop, statuses, _ = add_videos_to_playlist(youtube.client(), videos, "PLA")
+
+    assert should_stop
+    assert statuses == {0: LABEL_DONE, 1: LABEL_BLANK}
+
+
+def test_journal_after_a_torn_line(tmp_path):
+    """A line left halfway by a crash doesn't swallow the next one"""
+    path = tmp_path / "data.journal"
+    path.write_text("v1\tPLA\tdone\nv2\tPLA\tdo")
+    journal = uploader.StatusJournal(path)
+    journal.append("v3", "PLA", LABEL_DONE)
+    journal.close()
+
+    replayed = journal.replay(working_df(("v1", "PLA"), ("v2", "PLA"), ("v3", "PLA")))
+
+    assert list(replayed[COL_STATUS]) == [LABEL_DONE, LABEL_BLANK, LABEL_DONE]
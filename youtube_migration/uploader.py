@@ -2,16 +2,22 @@
 DISCLAIMER: this is provided for educataional purposes only. Use at your
 own risk
 
-Adds as many videos from a CSV as it can to a YouTube playlist. Then it
-creates another csv files with a summary of which videos where done. The
-next day, just rerun the script and it will do the next batch, until all
-done. The CSV files need to go into the data/  directory, and have a
-name that starts with a timestamp, like `20220828T170021_data.csv`. The format of the CSV is
+Adds as many videos from a CSV as it can to a YouTube playlist. The
+status of each video is appended to a journal next to the CSV as soon as
+it is known, and replayed over the CSV on the next run. The next day,
+just rerun the script and it will do the next batch, until all done.
+Run it with --compact to fold the journal into a new CSV. The CSV files
+need to go into the data/  directory, and have a name that starts with
+a timestamp, like `20220828T170021_data.csv`. The format of the CSV is
 
 Video ID,Time Added,Status,Playlist ID
 nmdUMwlrezs,2022-05-01 16:28:50 UTC,,PLZ6Ih9wLHQ2H1u5cOpSWgVGsn8YLWMmdy
 8qIMIAG5Z_E,2022-05-01 16:31:08 UTC,,PLZ6Ih9wLHQ2H1u5cOpSWgVGsn8YLWMmdy
 
+The working file can also be Parquet (`20220828T170021_data.parquet`,
+see csv-concat.py --parquet), which needs pyarrow. Only the rows still
+to do are then read from it. --export-csv writes the current state of
+either to a CSV, to look at.
 
 Usage:
     ❯ python uploader.py
@@ -20,18 +26,52 @@ Usage:
     Enter the authorization code: ....
     opening data/20220831T225517_data.csv
     ...
+
+    ❯ python uploader.py --compact
+    opening data/20220831T225517_data.csv
+    Created data/20220901T101204_data.csv
+
+    ❯ python uploader.py --export-csv progress.csv
+
+By default each video is added with a request of its own, so that the
+videos of a playlist keep their CSV order. --batch-size 50 sends them 50
+to an HTTP request instead, which is faster but lets YouTube add the
+videos of a batch in any order.
 """
 
+import argparse
+import csv
 import pandas as pd
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 import os
-from googleapiclient.discovery import build
+import threading
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from googleapiclient.errors import HttpError
-from google_auth_oauthlib.flow import InstalledAppFlow
+
+from api import (
+    execute_batch,
+    get_credentials,
+    message_of,
+    reason_of,
+    should_retry,
+    thread_local_clients,
+)
+from quota import COST_INSERT, QuotaLedger
+from snapshot import PlaylistStore
 
 DATA_DIR = Path("./data")
 FILE_STEM = "data.csv"
+SUFFIX_CSV = ".csv"
+SUFFIX_PARQUET = ".parquet"
+
+# In Parquet, Playlist ID is stored as a category. Status is left as a
+# string, which Parquet dictionary-encodes on disk anyway: as a category
+# pyarrow would not skip the row groups where all the videos are done
+ROW_GROUP_SIZE = 50_000
+
 COL_VIDEO_ID = "Video ID"
 COL_STATUS = "Status"
 COL_PLAYLIST_ID = "Playlist ID"
@@ -40,30 +80,76 @@ LABEL_404 = "videoNotFound"
 LABEL_BLANK = ""
 LABEL_QUOTA_EXCEEDED = "quotaExceeded"
 
-# This scope allows for full read/write
-# access to the authenticated user's account
-# and requires requests to use an SSL connection.
-SCOPES = ["https://www.googleapis.com/auth/youtube.force-ssl"]
-API_SERVICE_NAME = "youtube"
-API_VERSION = "v3"
-CLIENT_SECRETS_FILE = "client_secret.json"
+# Playlists are processed in parallel, each by one worker, so that videos
+# keep the order they have in the CSV. Set KEEP_PLAYLIST_ORDER to False
+# to also spread the videos of a single playlist over all the workers
+MAX_WORKERS = 4
+KEEP_PLAYLIST_ORDER = True
 
+# Inserts are sent BATCH_SIZE at a time in a single HTTP request, or
+# --batch-size. The API doesn't promise to run the requests of a batch in
+# order, so by default they are only batched when the order within a
+# playlist doesn't matter
+BATCH_SIZE = 1 if KEEP_PLAYLIST_ORDER else 50
+MAX_BATCH_SIZE = 50
 
-def get_authenticated_service():
-    """straight from the YouTube API documentation"""
-    flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
-    credentials = flow.run_console()
-    return build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
+# Statuses are appended to the journal as they come, and synced to disk
+# every JOURNAL_BATCH of them
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_BATCH = 20
 
 
 def pick_latest_file(dir: Path) -> Path:
     """assume that all files have a timestamp in the name, and hence the
     latest is the last one
     """
-    all_csvs = sorted(DATA_DIR.glob("*.csv"))
-    latest_csv = all_csvs.pop()
-    print(f"opening {latest_csv}")
-    return latest_csv
+    all_files = sorted(
+        path
+        for path in DATA_DIR.iterdir()
+        if path.suffix in (SUFFIX_CSV, SUFFIX_PARQUET)
+    )
+    latest_file = all_files.pop()
+    print(f"opening {latest_file}")
+    return latest_file
+
+
+def require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print(">>>> Parquet needs pyarrow: pip install pyarrow")
+        raise
+
+
+def read_working_file(path: Path, pending_only: bool = False) -> pd.DataFrame:
+    """read a CSV or Parquet working file, all as strings. With
+    pending_only, leave out the rows already done or not found: from
+    Parquet they are not even read
+    """
+    finished = [LABEL_DONE, LABEL_404]
+    if path.suffix == SUFFIX_PARQUET:
+        require_pyarrow()
+        df = pd.read_parquet(
+            path, filters=[(COL_STATUS, "not in", finished)] if pending_only else None
+        )
+        return df.astype(str)
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    if pending_only:
+        df = df[~df[COL_STATUS].isin(finished)]
+    return df
+
+
+def write_working_file(df: pd.DataFrame, path: Path):
+    """write a CSV or a Parquet file, going through a temporary file"""
+    tmp_file = path.with_suffix(".tmp")
+    if path.suffix == SUFFIX_PARQUET:
+        require_pyarrow()
+        df.astype({COL_PLAYLIST_ID: "category"}).to_parquet(
+            tmp_file, index=False, row_group_size=ROW_GROUP_SIZE
+        )
+    else:
+        df.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, path)
 
 
 def with_timestamp(stem: str) -> str:
@@ -73,105 +159,429 @@ def with_timestamp(stem: str) -> str:
     return dt_string + "_" + stem
 
 
-def video_is_already_in_playlist(client, video_id: str, playlist_id: str):
-    try:
-        print(f"-> Searching whether {video_id} is already in {playlist_id}")
-        response = (
-            client.playlistItems()
-            .list(
-                part="snippet, contentDetails",
-                playlistId=playlist_id,
-                videoId=video_id,
+class PlaylistMembership:
+    """which videos are in which playlist, read once per playlist from the
+    local snapshot, which is refreshed first if stale
+    """
+
+    def __init__(self, store: Optional[PlaylistStore] = None):
+        self.store = PlaylistStore() if store is None else store
+        self.playlists = {}
+        self.lock = threading.Lock()
+        self.playlist_locks = {}
+
+    def prefetch(self, client, playlist_id: str, ledger: QuotaLedger) -> bool:
+        """make sure the playlist is known, return true if it should stop"""
+        with self.lock:
+            playlist_lock = self.playlist_locks.setdefault(
+                playlist_id, threading.Lock()
             )
-            .execute()
+        with playlist_lock:
+            if playlist_id in self.playlists:
+                return False
+            if not self.store.is_fresh(playlist_id):
+                should_stop, items = self.store.refresh(client, playlist_id, ledger)
+                if items is None:
+                    return should_stop
+            video_ids = self.store.video_ids(playlist_id)
+            print(f"-> {playlist_id} already has {len(video_ids)} videos")
+            with self.lock:
+                self.playlists[playlist_id] = video_ids
+            return False
+
+    def contains(self, playlist_id: str, video_id: str) -> bool:
+        with self.lock:
+            return video_id in self.playlists.get(playlist_id, ())
+
+    def add(self, playlist_id: str, item):
+        """an item just inserted in the playlist"""
+        with self.lock:
+            if playlist_id in self.playlists:
+                self.playlists[playlist_id].add(item["contentDetails"]["videoId"])
+        self.store.add_item(playlist_id, item)
+
+
+class StatusJournal:
+    """append only log of the status of each video processed, one tab
+    separated line each: video id, playlist id, status
+    """
+
+    def __init__(self, path: Path, batch: int = JOURNAL_BATCH):
+        self.path = path
+        self.batch = batch
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.file = None
+
+    def replay(self, df: pd.DataFrame) -> pd.DataFrame:
+        """the CSV with the latest status of each video in the journal"""
+        if not self.path.exists() or not self.path.stat().st_size:
+            return df
+        events = pd.read_csv(
+            self.path,
+            sep="\t",
+            names=[COL_VIDEO_ID, COL_PLAYLIST_ID, COL_STATUS],
+            dtype=str,
+            keep_default_na=False,
+            quoting=csv.QUOTE_NONE,
+            on_bad_lines="skip",
         )
-        if len(response["items"]) > 0:
-            print("... yes it is, doing next")
-            return (True, LABEL_DONE)
-    except HttpError as e:
-        if e.error_details[0]["reason"] == "videoNotFound":  # type: ignore
-            print(f">>>> Are you sure about this video? ID not found {video_id}")
-        else:
-            print(
-                ">>>> ERROR LOOKING FOR VIDEO IN PLAYLIST"
-                f"{e.error_details[0]['message']}"
-            )  # type: ignore
-        return (True, e.error_details[0]["reason"])
-    return (False, None)
+        latest = events.drop_duplicates(
+            [COL_VIDEO_ID, COL_PLAYLIST_ID], keep="last"
+        ).set_index([COL_VIDEO_ID, COL_PLAYLIST_ID])[COL_STATUS]
+        replayed = latest.reindex(
+            pd.MultiIndex.from_frame(df[[COL_VIDEO_ID, COL_PLAYLIST_ID]])
+        ).to_numpy()
+        found = pd.notna(replayed)
+        replayed_df = df.copy()
+        replayed_df.loc[found, COL_STATUS] = replayed[found]
+        print(f"replayed {len(events)} statuses from {self.path}")
+        return replayed_df
 
+    def append(self, video_id: str, playlist_id: str, status: str):
+        with self.lock:
+            if self.file is None:
+                self.file = self._open()
+            self.file.write(f"{video_id}\t{playlist_id}\t{status}\n")
+            self.pending += 1
+            if self.pending >= self.batch:
+                self._sync()
 
-def add_another_video_to_playlist(client, video_id: str, playlist_id: str):
-    try:
-        print(f"-> Adding {video_id} to {playlist_id}")
-        response = (
-            client.playlistItems()
-            .insert(
-                part="snippet, contentDetails",
-                body={
-                    "contentDetails": {"videoId": video_id},
-                    "snippet": {
-                        "playlistId": playlist_id,
-                        "resourceId": {
-                            "kind": "youtube#video",
-                            "videoId": video_id,
-                        },
-                    },
+    def _open(self):
+        """open the journal to append to it. If a crash left the last line
+        halfway, that line is cut off first: it wasn't synced, and its
+        status might be cut short
+        """
+        if self.path.exists():
+            with open(self.path, "rb+") as file:
+                content = file.read()
+                if content and not content.endswith(b"\n"):
+                    file.truncate(content.rfind(b"\n") + 1)
+        return open(self.path, "a")
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._sync()
+                self.file.close()
+                self.file = None
+
+
+def journal_for(source_file: Path) -> StatusJournal:
+    return StatusJournal(source_file.with_suffix(JOURNAL_SUFFIX))
+
+
+def insert_request(client, video_id: str, playlist_id: str):
+    return client.playlistItems().insert(
+        part="snippet, contentDetails",
+        body={
+            "contentDetails": {"videoId": video_id},
+            "snippet": {
+                "playlistId": playlist_id,
+                "resourceId": {
+                    "kind": "youtube#video",
+                    "videoId": video_id,
                 },
+            },
+        },
+    )
+
+
+def add_videos_to_playlist(client, videos, playlist_id: str):
+    """add a batch of (row index, video id) with a single HTTP request.
+    Return a tuple: true if it should stop, false otherwise; the status
+    of each row index; and the playlist item of each row index inserted
+    """
+    should_stop = False
+    statuses = {}
+    inserted = {}
+
+    def callback(request_id, response, exception):
+        nonlocal should_stop
+        index, video_id = videos[int(request_id)]
+        if exception is None:
+            print(
+                f" + {response['snippet']['title']} / "
+                f"{response['snippet']['position']} in playlist"
             )
-            .execute()
-        )
-        print(
-            f" + {response['snippet']['title']} / "
-            f"{response['snippet']['position']} in playlist"
-        )
-        return (False, LABEL_DONE)
-    except HttpError as e:
-        if e.error_details[0]["reason"] == LABEL_QUOTA_EXCEEDED:  # type: ignore
+            statuses[index] = LABEL_DONE
+            inserted[index] = response
+        elif not isinstance(exception, HttpError):
+            print(f">>>> ERROR adding {video_id} {exception}")
+            statuses[index] = LABEL_BLANK
+        elif reason_of(exception) == LABEL_QUOTA_EXCEEDED:
             print(f">>>> Quota exceeded when trying to add {video_id}")
-            return (True, LABEL_BLANK)
-        processed_df.at[row.Index, COL_STATUS] = e.error_details[0]["reason"]  # type: ignore
-        print(f">>>> ERROR {e.error_details[0]['message']}")  # type: ignore
-        return (False, e.error_details[0]["reason"])
+            should_stop = True
+            statuses[index] = LABEL_BLANK
+        elif should_retry(exception):
+            print(f">>>> Giving up on {video_id} for now: {message_of(exception)}")
+            statuses[index] = LABEL_BLANK
+        else:
+            print(f">>>> ERROR {message_of(exception)}")
+            statuses[index] = reason_of(exception) or str(exception.resp.status)
 
+    requests = {}
+    for request_id, (_, video_id) in enumerate(videos):
+        print(f"-> Adding {video_id} to {playlist_id}")
+        requests[str(request_id)] = insert_request(client, video_id, playlist_id)
+    try:
+        execute_batch(client, requests, callback)
+    except HttpError as e:
+        if reason_of(e) == LABEL_QUOTA_EXCEEDED:
+            print(">>>> Quota exceeded when trying to add a batch")
+            return (True, statuses, inserted)
+        print(f">>>> ERROR {message_of(e)}")
+    return (should_stop, statuses, inserted)
 
-def partly_processed_csv(client, source_df: pd.DataFrame) -> pd.DataFrame:
-    processed_df = source_df.copy()
-    for row in processed_df.itertuples():
-        data = processed_df.loc[row.Index, [COL_VIDEO_ID, COL_STATUS, COL_PLAYLIST_ID]]
-        video_id, status, playlist_id = data.values
-        if status in [LABEL_DONE, LABEL_404]:
-            continue
-
-        should_skip, reason = video_is_already_in_playlist(
-            client, video_id=video_id, playlist_id=playlist_id
-        )
-        if should_skip:
-            processed_df.at[row.Index, COL_STATUS] = reason
-            continue
 
-        should_stop, status = add_another_video_to_playlist(
-            client, video_id=video_id, playlist_id=playlist_id
+def prefetch_playlist(get_client, membership, ledger, playlist_id: str, stop):
+    if stop.is_set():
+        return
+    if membership.prefetch(get_client(), playlist_id, ledger):
+        stop.set()
+
+
+def plan_inserts(queues, membership, ledger, record, max_workers: int):
+    """mark the videos already in their playlist as done, and keep only as
+    many of the others as today's quota allows, first come first served.
+    Return the work for the workers
+    """
+    pending = []
+    for playlist_id, queue in queues.items():
+        for index, video_id in queue:
+            if membership.contains(playlist_id, video_id):
+                record(index, LABEL_DONE)
+            else:
+                pending.append((index, video_id, playlist_id))
+
+    budget = ledger.affordable(COST_INSERT)
+    if len(pending) > budget:
+        print(f"-> Quota left for {budget} videos, {len(pending) - budget} deferred")
+        pending = sorted(pending)[:budget]
+
+    planned = {}
+    for index, video_id, playlist_id in sorted(pending):
+        planned.setdefault(playlist_id, []).append((index, video_id))
+
+    work = []
+    for playlist_id, queue in planned.items():
+        if KEEP_PLAYLIST_ORDER:
+            work.append((playlist_id, queue))
+        else:
+            work.extend(
+                (playlist_id, queue[i::max_workers]) for i in range(max_workers)
+            )
+    return work
+
+
+def process_queue(
+    get_client,
+    membership,
+    ledger,
+    playlist_id: str,
+    queue,
+    stop,
+    record,
+    batch_size: int = BATCH_SIZE,
+):
+    """add the videos in the queue to the playlist, a batch at a time,
+    until done or until any worker runs out of quota
+    """
+    client = get_client()
+    pending = iter(queue)
+    while not stop.is_set():
+        videos = []
+        for index, video_id in pending:
+            if membership.contains(playlist_id, video_id):
+                print(f"-> {video_id} is already in {playlist_id}, doing next")
+                record(index, LABEL_DONE)
+                continue
+            if any(video_id == batched for _, batched in videos):
+                # the same video twice: find out if the first one made it
+                pending = chain([(index, video_id)], pending)
+                break
+            if not ledger.charge(COST_INSERT):
+                stop.set()
+                break
+            videos.append((index, video_id))
+            if len(videos) >= batch_size:
+                break
+        if not videos:
+            return
+
+        should_stop, statuses, inserted = add_videos_to_playlist(
+            client, videos, playlist_id
         )
-        processed_df.at[row.Index, COL_STATUS] = status
+        for index, video_id in videos:
+            status = statuses.get(index, LABEL_BLANK)
+            record(index, status)
+            if status == LABEL_DONE:
+                membership.add(playlist_id, inserted[index])
         if should_stop:
-            return processed_df
+            ledger.exhausted()
+            stop.set()
 
+
+def pending_queues(df: pd.DataFrame) -> dict:
+    """playlist id => list of (row index, video id) still to do, in CSV
+    order. Finished rows are filtered out in one go
+    """
+    pending = df[~df[COL_STATUS].isin([LABEL_DONE, LABEL_404])]
+    queues = {}
+    for index, video_id, playlist_id in zip(
+        pending.index, pending[COL_VIDEO_ID], pending[COL_PLAYLIST_ID]
+    ):
+        queues.setdefault(playlist_id, []).append((index, video_id))
+    return queues
+
+
+def partly_processed_csv(
+    get_client,
+    source_df: pd.DataFrame,
+    max_workers: int = MAX_WORKERS,
+    membership: Optional[PlaylistMembership] = None,
+    ledger: Optional[QuotaLedger] = None,
+    journal: Optional[StatusJournal] = None,
+    batch_size: int = BATCH_SIZE,
+) -> pd.DataFrame:
+    membership = PlaylistMembership() if membership is None else membership
+    ledger = QuotaLedger() if ledger is None else ledger
+    processed_df = source_df.copy()
+    queues = pending_queues(processed_df)
+
+    statuses = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def record(index, status):
+        with lock:
+            statuses[index] = status
+        if journal is not None and status != LABEL_BLANK:
+            journal.append(
+                processed_df.at[index, COL_VIDEO_ID],
+                processed_df.at[index, COL_PLAYLIST_ID],
+                status,
+            )
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        # listing is cheap, and tells which videos need no insert at all
+        futures = [
+            executor.submit(
+                prefetch_playlist, get_client, membership, ledger, playlist_id, stop
+            )
+            for playlist_id in queues
+        ]
+        for future in futures:
+            future.result()
+
+        work = (
+            []
+            if stop.is_set()
+            else plan_inserts(queues, membership, ledger, record, max_workers)
+        )
+        futures = [
+            executor.submit(
+                process_queue,
+                get_client,
+                membership,
+                ledger,
+                playlist_id,
+                queue,
+                stop,
+                record,
+                batch_size,
+            )
+            for playlist_id, queue in work
+            if queue
+        ]
+        for future in futures:
+            future.result()
+    except KeyboardInterrupt:
+        print(">>>> Interrupted, saving what was done so far")
+        stop.set()
+    finally:
+        # workers stop after their current request once stop is set
+        executor.shutdown(wait=True)
+        ledger.save()
+        if journal is not None:
+            journal.close()
+        if statuses:
+            processed_df.loc[list(statuses), COL_STATUS] = list(statuses.values())
     return processed_df
 
 
-def main(client):
+def compact(source_file: Path) -> Path:
+    """fold the journal into a new working file of the same format, and
+    remove the old one and its journal
+    """
+    journal = journal_for(source_file)
+    compacted_df = journal.replay(read_working_file(source_file))
+    latest_file = (DATA_DIR / with_timestamp(FILE_STEM)).with_suffix(source_file.suffix)
+    write_working_file(compacted_df, latest_file)
+    journal.path.unlink(missing_ok=True)
+    source_file.unlink()
+    return latest_file
+
+
+def batch_size_arg(value: str) -> int:
+    size = int(value)
+    if not 1 <= size <= MAX_BATCH_SIZE:
+        raise argparse.ArgumentTypeError(f"between 1 and {MAX_BATCH_SIZE}")
+    return size
+
+
+def main(get_client, batch_size: int = BATCH_SIZE):
     source_file = pick_latest_file(DATA_DIR)
-    source_df = pd.read_csv(source_file)
-    processed_df = partly_processed_csv(client, source_df)
-    latest_file = with_timestamp(FILE_STEM)
-    processed_df.to_csv(DATA_DIR / latest_file, index=False)
+    journal = journal_for(source_file)
+    source_df = read_working_file(source_file, pending_only=True)
+    partly_processed_csv(
+        get_client, journal.replay(source_df), journal=journal, batch_size=batch_size
+    )
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="write the journal into a new CSV instead of uploading",
+    )
+    parser.add_argument(
+        "--export-csv",
+        type=Path,
+        metavar="CSV",
+        help="write the working file, with the journal, to a CSV instead of uploading",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=batch_size_arg,
+        default=BATCH_SIZE,
+        help=f"how many videos to add per HTTP request, up to {MAX_BATCH_SIZE}. "
+        "Above 1 the videos of a playlist may be added out of CSV order "
+        f"(default: {BATCH_SIZE})",
+    )
+    args = parser.parse_args()
+    if args.compact:
+        print(f"Created {compact(pick_latest_file(DATA_DIR))}")
+        exit()
+    if args.export_csv:
+        source_file = pick_latest_file(DATA_DIR)
+        journal = journal_for(source_file)
+        write_working_file(
+            journal.replay(read_working_file(source_file)), args.export_csv
+        )
+        print(f"Created {args.export_csv}")
+        exit()
+
     # When running locally, disable OAuthlib's
     # HTTPs verification. When running in production
     # * do not * leave this option enabled.
     os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
-    client = get_authenticated_service()
-    main(client)
+    main(thread_local_clients(get_credentials()), args.batch_size)
     print("DONE")